@@ -0,0 +1,520 @@
+"""
+Benchmarks of the test tree and selection structures on synthetic suites.
+
+A suite of the requested shape is generated (and reused on later runs),
+collected once with ``pytest`` and each benchmark is then run in process on
+the collected items. Results can be written as JSON and compared against a
+previous run to gate performance changes::
+
+    python bench/benchmark.py --items 100000 --json base.json
+    # ... change things ...
+    python bench/benchmark.py --items 100000 --compare base.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import pytest
+
+try:
+    import tracemalloc
+except ImportError:  # e.g. PyPy
+    tracemalloc = None
+
+timer = time.perf_counter
+
+SHAPE_FILE = 'shape.json'
+# allowed slow down of the simulated tests when recording line coverage
+# with ``sys.monitoring`` (nightly runs leave recording enabled)
+MAX_TRACE_OVERHEAD = 0.5
+
+MODULE = '''\
+import pytest
+
+A = {a!r}
+B = {b!r}
+
+{funcs}
+
+class TestBase(object):
+    @pytest.mark.parametrize('c', A)
+    def test_cls(self, c):
+        pass
+
+
+class TestChild(TestBase):
+    pass
+
+
+class TestSibling(TestBase):
+    pass
+'''
+
+FUNC = '''\
+@pytest.mark.parametrize('b', B)
+@pytest.mark.parametrize('a', A)
+def test_cross_{i}(a, b):
+    pass
+'''
+
+
+# pure python code exercised by each simulated test when measuring the
+# overhead of recording coverage
+WORKLOAD = '''\
+class Account(object):
+    def __init__(self, balance=0):
+        self.balance = balance
+        self.history = []
+
+    def deposit(self, amount):
+        if amount <= 0:
+            raise ValueError(amount)
+        self.balance += amount
+        self.history.append(amount)
+        return self.balance
+
+
+def parse(text):
+    fields = {}
+    for part in text.split(';'):
+        key, _, value = part.partition('=')
+        fields[key.strip()] = value.strip()
+    return fields
+
+
+def run(n):
+    account = Account()
+    total = 0
+    for i in range(n):
+        account.deposit(i + 1)
+        total += len(parse('a=1; b=2; c={}'.format(i)))
+    return total
+'''
+
+
+def module_size(shape):
+    params = shape['params']
+    return shape['funcs'] * params * params + 3 * params
+
+
+def generate(root, shape):
+    """Write a suite of about ``shape['items']`` tests to ``root`` made of
+    packages nested ``depth`` deep with ``width`` sub-packages each where
+    every module holds ``funcs`` functions parametrized by the cross
+    product of two ``params`` long id lists along with a parametrized class
+    hierarchy (as in ``example_test_set/tests/test_inheritance.py``)
+    """
+    nmodules = max(1, -(-shape['items'] // module_size(shape)))
+    leaves = ['']
+    for _ in range(shape['depth']):
+        leaves = [os.path.join(leaf, 'pkg{}'.format(i))
+                  for leaf in leaves for i in range(shape['width'])]
+    params = shape['params']
+    source = MODULE.format(
+        a=['a{}'.format(i) for i in range(params)],
+        b=['b{}'.format(i) for i in range(params)],
+        funcs='\n\n'.join(
+            FUNC.format(i=i) for i in range(shape['funcs'])))
+    for i in range(nmodules):
+        leaf = leaves[i % len(leaves)]
+        path = root
+        for part in leaf.split(os.sep):
+            if not part:
+                continue
+            path = os.path.join(path, part)
+            if not os.path.isdir(path):
+                os.mkdir(path)
+                open(os.path.join(path, '__init__.py'), 'w').close()
+        with open(os.path.join(path, 'test_mod{}.py'.format(i)), 'w') as f:
+            f.write(source)
+    with open(os.path.join(root, SHAPE_FILE), 'w') as f:
+        json.dump(shape, f)
+
+
+class Collector(object):
+    """Plugin capturing the collected items and the session's config
+    """
+    items = config = None
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        self.items = list(items)
+        self.config = config
+
+
+def collect(root):
+    collector = Collector()
+    pytest.main([root, '--collect-only', '--rootdir', root,
+                 '-p', 'no:terminal', '-W', 'ignore'], plugins=[collector])
+    return collector.items, collector.config
+
+
+class NullReporter(object):
+    """Terminal reporter discarding all output
+    """
+    def write(self, *args, **kwargs):
+        pass
+
+    def write_line(self, *args, **kwargs):
+        pass
+
+
+def measure(func, repeat):
+    """Return the best and median wall time of ``repeat`` calls of func
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = timer()
+        func()
+        times.append(timer() - start)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def heap(func):
+    """Return the bytes retained by and the peak allocation of ``func()``
+    """
+    if tracemalloc is None:
+        return None, None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current - before, peak - before
+
+
+def benchmarks(items, config):
+    """Return an ordered list of ``(name, func)`` benchmarks
+    """
+    from interactive.plugin import TestTree, FuncCollection
+    from interactive.render import TreeRenderer
+    from interactive.index import (CachedTestTree, save_index, load_index,
+                                   dump_index)
+    tr = NullReporter()
+
+    def build(lazy=False):
+        return TestTree(items, tr, None, FuncCollection(), config, lazy=lazy)
+
+    tree = build()
+    collectors = [path for path in tree._path2children
+                  if not isinstance(tree._nodes.get(path), pytest.Item)]
+    sample = collectors[::max(1, len(collectors) // 100)]
+    idents = tuple(sorted(tree._param2ids)[:10])
+    itemids = list(range(len(items)))
+    module = next(path for path in collectors
+                  if isinstance(tree._nodes.get(path), pytest.Module))
+    cached = [item.nodeid for item in items[::10]]
+
+    # interned test sets (and their memoized results) are dropped before
+    # each query such that the first access in a session is measured
+    def childkeys():
+        tree._cache.clear()
+        for path in sample:
+            dir(tree._testset(path))
+            tree._testset(path, params=idents[:1])._childkeys
+
+    def complete():
+        tree._cache.clear()
+        for path in sample:
+            tree._testset(path)._complete('test_')
+            tree._testset(path, params=idents[:1])._complete('')
+
+    def params():
+        tree._cache.clear()
+        namespace = tree._root.params
+        for ident in idents:
+            len(getattr(namespace, ident)._items)
+
+    def filtering():
+        tree._cache.clear()
+        tt = tree._root
+        len(tt._items)
+        len(tt[::7]._items)
+        first, second = idents[:2]
+        len(getattr(tree._testset(module).params, first)._items)
+        len((getattr(tt.params, first) | getattr(tt.params, second))._items)
+        len((tt - getattr(tt.params, first))._items)
+
+    def render_page():
+        tree._cache.clear()
+        tree._tprint(None, tr=tr, itemids=itemids, limit=tree.page_size)
+
+    def render_fit():
+        renderer = TreeRenderer(tree)
+        renderer.depth = renderer.fit(itemids, tree.page_size)
+        renderer.lines(itemids)
+
+    def render_module():
+        tree._cache.clear()
+        tree._tprint(None, tr=tr, itemids=list(tree._testset(module)._ids()))
+
+    def selection():
+        tree._cache.clear()
+        tt = tree._root
+        selection = FuncCollection()
+        selection.addtests(tt)
+        for i in range(0, len(selection), max(1, len(selection) // 1000)):
+            selection[i]
+        selection.removeitems(selection[::3])
+        selection.removematching(r'b1\]')
+        len(selection.keys())
+        selection.clear()
+
+    def search_index():
+        tree._trigrams = None
+        tree._search_index()
+
+    def find():
+        tree._cache.clear()
+        tt = tree._root
+        tt.find('test_cross_0[a1-')
+        tt.find(r'pkg0.*test_cls\[a[0-3]\]', regex=True)
+
+    def cache_save():
+        save_index(tree)
+
+    def cache_load():
+        index = load_index(config)
+        CachedTestTree.from_index(index, tr, None, FuncCollection(), config)
+
+    def cache_subset():
+        tree._cache.clear()
+        tree._nodeid2id_version = None
+        len(tree._subset(cached)._items)
+
+    return [
+        ('build', build),
+        ('build_lazy', lambda: build(lazy=True)),
+        ('childkeys', childkeys),
+        ('complete', complete),
+        ('params', params),
+        ('items', filtering),
+        ('render_page', render_page),
+        ('render_fit', render_fit),
+        ('render_module', render_module),
+        ('selection', selection),
+        ('search_index', search_index),
+        ('find', find),
+        ('cache_save', cache_save),
+        ('cache_load', cache_load),
+        ('cache_subset', cache_subset),
+        ('dump_index', lambda: dump_index(tree)),
+    ], build
+
+
+def tracing(root, tests=200, size=100):
+    """Return benchmarks running ``tests`` simulated tests of a workload
+    under ``root`` without a tracer and recording files or lines
+    """
+    from interactive.coverage_map import Tracer
+    path = os.path.join(root, 'workload.py')
+    if not os.path.exists(path):
+        with open(path, 'w') as f:
+            f.write(WORKLOAD)
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    import workload
+
+    def untraced():
+        for _ in range(tests):
+            workload.run(size)
+
+    def traced(lines):
+        tracer = Tracer(root, lines=lines)
+
+        def run():
+            for _ in range(tests):
+                tracer.start()
+                workload.run(size)
+                tracer.stop()
+                tracer.reset()
+        return run, tracer
+
+    files, files_tracer = traced(False)
+    lines, lines_tracer = traced(True)
+    cases = [
+        ('trace_none', untraced),
+        ('trace_files', files),
+        ('trace_lines', lines),
+    ]
+    return cases, (files_tracer, lines_tracer)
+
+
+def run(args):
+    shape = dict(items=args.items, depth=args.depth, width=args.width,
+                 params=args.params, funcs=args.funcs)
+    root = args.dir
+    tmp = None
+    if root is None:
+        root = tmp = tempfile.mkdtemp(prefix='ia-bench-')
+    root = os.path.abspath(root)
+    try:
+        existing = None
+        marker = os.path.join(root, SHAPE_FILE)
+        if os.path.exists(marker):
+            with open(marker) as f:
+                existing = json.load(f)
+        if existing != shape:
+            if os.path.isdir(root):
+                shutil.rmtree(root)
+            os.makedirs(root)
+            generate(root, shape)
+        start = timer()
+        items, config = collect(root)
+        collection = timer() - start
+        results = {
+            'shape': shape,
+            'items': len(items),
+            'python': platform.python_version(),
+            'pytest': pytest.__version__,
+            'collection': collection,
+            'times': {},
+            'memory': {},
+        }
+        print("{} items collected in {:.2f}s".format(len(items), collection))
+        cases, build = benchmarks(items, config)
+        for name, func in cases:
+            if args.only and name not in args.only:
+                continue
+            best, median = measure(func, args.repeat)
+            results['times'][name] = best
+            print("{:<16}{:>10.2f}ms {:>10.2f}ms".format(
+                name, best * 1e3, median * 1e3))
+        cases, tracers = tracing(root)
+        times = results['times']
+        for name, func in cases:
+            # the overhead is relative to 'trace_none' so all are measured
+            if args.only and not set(args.only) & set(dict(cases)):
+                continue
+            best, median = measure(func, args.repeat)
+            times[name] = best
+            print("{:<16}{:>10.2f}ms {:>10.2f}ms".format(
+                name, best * 1e3, median * 1e3))
+        results['tracer'] = tracers[0].backend
+        for tracer in tracers:
+            tracer.close()
+        results['overhead'] = {}
+        if times.get('trace_none'):
+            for mode in ('files', 'lines'):
+                traced = times.get('trace_' + mode)
+                if traced is None:
+                    continue
+                overhead = traced / times['trace_none'] - 1
+                results['overhead'][mode] = overhead
+                print("{:<16}{:>+10.0%} recording overhead with {}".format(
+                    mode, overhead, results['tracer']))
+        if tracemalloc is not None:
+            per = 10000. / len(items)
+            for name, lazy in (('tree', False), ('tree_lazy', True)):
+                retained, peak = heap(lambda: build(lazy=lazy))
+                results['memory'][name] = retained * per
+                results['memory'][name + '_peak'] = peak * per
+                print("{:<16}{:>10.1f}KB per 10k items (peak {:.1f}KB)"
+                      .format(name, retained * per / 1024,
+                              peak * per / 1024))
+        return results
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of all metrics which regressed by more than
+    ``tolerance`` (a fraction) relative to ``baseline``
+    """
+    regressions = []
+    for kind in ('times', 'memory'):
+        for name, value in sorted(results[kind].items()):
+            base = baseline.get(kind, {}).get(name)
+            if not base:
+                continue
+            change = value / base - 1
+            if change > tolerance:
+                regressions.append("{} {}: {:+.0%} ({:.4g} -> {:.4g})".format(
+                    kind, name, change, base, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--items', type=int, default=10000,
+                        help="approximate number of tests to generate")
+    parser.add_argument('--depth', type=int, default=3,
+                        help="package nesting depth")
+    parser.add_argument('--width', type=int, default=3,
+                        help="sub-packages per package")
+    parser.add_argument('--params', type=int, default=10,
+                        help="ids per parametrize (cross products are "
+                        "params ** 2)")
+    parser.add_argument('--funcs', type=int, default=2,
+                        help="parametrized functions per module")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dir', help="directory of the generated suite "
+                        "(reused when the shape matches)")
+    parser.add_argument('--only', nargs='+', help="benchmarks to run")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="fail if any result regressed relative to the "
+                        "results in this file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed regression as a fraction "
+                        "(default: %(default)s)")
+    parser.add_argument('--max-heap', type=float, metavar='KB',
+                        help="fail if the (eager) tree retains more than "
+                        "this many KB per 10k items")
+    parser.add_argument('--max-trace-overhead', type=float,
+                        metavar='FRACTION',
+                        help="fail if recording line coverage slows the "
+                        "simulated tests down by more than this fraction "
+                        "(default: {} with sys.monitoring, not checked for "
+                        "the sys.settrace fallback unless given)".format(
+                            MAX_TRACE_OVERHEAD))
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    status = 0
+    heap = results['memory'].get('tree')
+    if args.max_heap and heap is not None and heap / 1024 > args.max_heap:
+        print("REGRESSION tree heap of {:.1f}KB per 10k items exceeds "
+              "{:.1f}KB".format(heap / 1024, args.max_heap))
+        status = 1
+    overhead = results['overhead'].get('lines')
+    limit = args.max_trace_overhead
+    if limit is None and results.get('tracer') == 'sys.monitoring':
+        limit = MAX_TRACE_OVERHEAD
+    if overhead is not None and limit is None:
+        print("note: line coverage overhead is not checked for {}".format(
+            results.get('tracer')))
+    elif overhead is not None and overhead > limit:
+        print("REGRESSION line coverage overhead of {:.0%} exceeds "
+              "{:.0%}".format(overhead, limit))
+        status = 1
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('shape') != results['shape']:
+            print("warning: baseline was run on a different suite shape")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Compact integer id sets used to index test items
+"""
+from array import array
+from bisect import bisect_left
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+class Bitset(object):
+    '''An immutable set of non-negative integer ids stored as a single
+    python ``int`` bit mask relative to its lowest member.
+
+    Storing the mask relative to an offset keeps sets of (mostly) contiguous
+    high valued ids - the common case for the items under a pytest
+    collector - as small as the span they cover.
+    '''
+    __slots__ = ('lo', 'mask')
+
+    def __init__(self, lo=0, mask=0):
+        if mask:
+            # normalize such that the lowest bit is always set
+            low = (mask & -mask).bit_length() - 1
+            mask >>= low
+            lo += low
+        else:
+            lo = 0
+        self.lo = lo
+        self.mask = mask
+
+    @classmethod
+    def from_ids(cls, ids):
+        '''Build a set from an iterable of ids
+        '''
+        ids = sorted(ids)
+        if not ids:
+            return cls()
+        lo, hi = ids[0], ids[-1]
+        span = hi - lo + 1
+        if span == len(ids):  # contiguous range
+            return cls(lo, (1 << span) - 1)
+        buf = bytearray((span >> 3) + 1)
+        for i in ids:
+            i -= lo
+            buf[i >> 3] |= 1 << (i & 7)
+        return cls(lo, int.from_bytes(bytes(buf), 'little'))
+
+    @classmethod
+    def from_range(cls, start, stop):
+        if stop <= start:
+            return cls()
+        return cls(start, (1 << (stop - start)) - 1)
+
+    def _aligned(self, other, lo):
+        '''Return both masks shifted to share the offset ``lo``
+        '''
+        return (self.mask << (self.lo - lo), other.mask << (other.lo - lo))
+
+    def __and__(self, other):
+        if not isinstance(other, Bitset):
+            return NotImplemented
+        if not (self.mask and other.mask):
+            return Bitset()
+        lo = max(self.lo, other.lo)
+        mask = (self.mask >> (lo - self.lo)) & (other.mask >> (lo - other.lo))
+        return Bitset(lo, mask)
+
+    def __or__(self, other):
+        if not other.mask:
+            return self
+        if not self.mask:
+            return other
+        lo = min(self.lo, other.lo)
+        a, b = self._aligned(other, lo)
+        return Bitset(lo, a | b)
+
+    def __xor__(self, other):
+        lo = min(self.lo, other.lo)
+        a, b = self._aligned(other, lo)
+        return Bitset(lo, a ^ b)
+
+    def __sub__(self, other):
+        if not (self.mask and other.mask):
+            return self
+        shift = other.lo - self.lo
+        omask = other.mask << shift if shift >= 0 else other.mask >> -shift
+        return Bitset(self.lo, self.mask & ~omask)
+
+    def intersects(self, other):
+        '''Fast check for a non-empty intersection
+        '''
+        if not (self.mask and other.mask):
+            return False
+        lo = max(self.lo, other.lo)
+        return bool(
+            (self.mask >> (lo - self.lo)) & (other.mask >> (lo - other.lo)))
+
+    def __contains__(self, i):
+        i -= self.lo
+        return i >= 0 and bool((self.mask >> i) & 1)
+
+    def __iter__(self):
+        '''Iterate member ids in ascending order
+        '''
+        mask, lo = self.mask, self.lo
+        if not mask & (mask + 1):  # contiguous range
+            return iter(range(lo, lo + mask.bit_length()))
+        return self._iterbits(mask, lo)
+
+    @staticmethod
+    def _iterbits(mask, lo):
+        bits = bin(mask)[:1:-1]  # least significant bit first
+        i = bits.find('1')
+        while i >= 0:
+            yield lo + i
+            i = bits.find('1', i + 1)
+
+    def __len__(self):
+        return _popcount(self.mask)
+
+    def __bool__(self):
+        return bool(self.mask)
+
+    def __eq__(self, other):
+        return (isinstance(other, Bitset) and self.lo == other.lo and
+                self.mask == other.mask)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.lo, self.mask))
+
+    def __repr__(self):
+        return "<{} with {} ids>".format(type(self).__name__, len(self))
+
+
+class SortedIds(object):
+    '''An immutable set of ids stored as a sorted ``array`` which takes
+    less memory than a ``Bitset`` when the ids are sparse over their span
+    (4 bytes per id instead of 1 bit per id spanned). Intersections with a
+    ``Bitset`` only visit the ids within its span.
+    '''
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        self.ids = ids if isinstance(ids, array) else array('I', ids)
+
+    def _within(self, other):
+        '''Return the ids within the span of the ``Bitset`` ``other``
+        '''
+        ids = self.ids
+        if not other.mask:
+            return ids[:0]
+        start = bisect_left(ids, other.lo)
+        stop = bisect_left(
+            ids, other.lo + other.mask.bit_length(), start)
+        return ids[start:stop]
+
+    def __and__(self, other):
+        if not isinstance(other, Bitset):
+            return NotImplemented
+        within = self._within(other)
+        if not within:
+            return Bitset()
+        return Bitset.from_ids(within) & other
+
+    __rand__ = __and__
+
+    def intersects(self, other):
+        within = self._within(other)
+        if not within:
+            return False
+        mask = other.mask
+        if not mask & (mask + 1):  # contiguous range
+            return True
+        return Bitset.from_ids(within).intersects(other)
+
+    def __contains__(self, i):
+        ids = self.ids
+        pos = bisect_left(ids, i)
+        return pos < len(ids) and ids[pos] == i
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return bool(self.ids)
+
+    def __repr__(self):
+        return "<{} with {} ids>".format(type(self).__name__, len(self))
+
+
+def compact(ids):
+    '''Return the smaller of a ``Bitset`` and ``SortedIds`` holding the
+    sorted ``array`` of ``ids``
+    '''
+    if ids and (ids[-1] - ids[0] + 1) <= 32 * len(ids):
+        return Bitset.from_ids(ids)
+    return SortedIds(ids)
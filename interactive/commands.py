@@ -0,0 +1,428 @@
+"""
+Test selection commands, completion and prompt shared by the shell backends
+"""
+import re
+import getopt
+import keyword
+from operator import itemgetter
+from .durations import get_index, parse_duration, format_duration
+
+
+# a chain of attribute and literal subscript lookups such as
+# ``tt.tests['test_a'][1:3]`` which can be evaluated without side effects
+_chain = (r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*|"
+          r"\[(?:'[^'\]]*'|\"[^\"\]]*\"|[-\d: ]*)\])*")
+_attr_re = re.compile(r"(?:^|[^\w.\]'\"])(" + _chain + r")\.(\w*)$")
+_key_re = re.compile(
+    r"(?:^|[^\w.\]'\"])(" + _chain + r")\[(['\"])([^'\"]*)$")
+
+
+class TreeCompleter(object):
+    """Complete attribute and string key lookups on test sets (and their
+    ``params``) directly from the tree's sorted key arrays instead of
+    having IPython call ``dir()`` or jedi evaluate the expression.
+    """
+    def __init__(self, shell):
+        self.shell = shell
+
+    def complete(self, text):
+        """Return the matched fragment and its completions for the text
+        preceding the cursor or ``None`` if it isn't a test set lookup
+        """
+        from .plugin import TestSet, CallspecParameters
+        keys = False
+        match = _attr_re.search(text)
+        if match:
+            expr, fragment = match.groups()
+        else:
+            keys = True
+            match = _key_re.search(text)
+            if not match:
+                return None
+            expr, fragment = match.group(1), match.group(3)
+        ns = self.shell.user_ns
+        types = (TestSet, CallspecParameters)
+        # only evaluate lookups rooted at one of our objects
+        root = re.match(r'\w+', expr).group()
+        if not isinstance(ns.get(root), types):
+            return None
+        try:
+            obj = eval(expr, ns)
+        except Exception:
+            return None
+        if keys:
+            # only test sets support string key lookups
+            if not isinstance(obj, TestSet):
+                return None
+            return fragment, obj._complete(fragment, keys=True)
+        if not isinstance(obj, types):
+            return None
+        return fragment, obj._complete(fragment)
+
+
+def prompt_parts(ns):
+    """Return the collection progress (if still collecting), the number of
+    selected tests and the remainder of the prompt for the shell namespace
+    ``ns``
+    """
+    selection = ns['_selection']
+    tree = ns.get('_tree')
+    selected = ' selected'
+    if tree is not None and selection:
+        # report the selection's estimated run time
+        estimate = tree._estimate(selection.values())
+        if estimate is not None:
+            selected += ' (~{})'.format(format_duration(estimate))
+    progress = ''
+    if tree is not None and tree._collecting:
+        # report progress while tests are still being collected
+        tree._refresh()
+        progress = 'collecting ({} tests) '.format(len(tree._funcitems))
+    return progress, '{}'.format(len(selection)), selected + ' >>> '
+
+
+def exit_message(shell):
+    """Return the message confirming ``shell``'s exit, printing a summary of
+    the selected tests (if any) collapsed to fit on a single page
+    """
+    selection = getattr(shell, 'selection', None)
+    if not selection:
+        return 'Do you really want to exit ([y]/n)?'
+    tree = shell.user_ns['_tree']
+    from .render import TreeRenderer
+    itemids = tree._itemids(selection.values())
+    renderer = TreeRenderer(tree)
+    renderer.depth = renderer.fit(itemids, tree.page_size)
+    renderer.write(tree._tr, itemids)
+    estimate = tree._estimate(selection.values())
+    estimate = " (~{})".format(format_duration(estimate)) \
+        if estimate is not None else ''
+    return "\nYou have selected the above {} test(s){} to be run."\
+           "\nWould you like to run pytest now? ([y]/n)?"\
+           .format(len(selection), estimate)
+
+
+class SelectionCommands(object):
+    """Commands for performing multiple test selections within a single
+    session. Each command takes the rest of its command line and is run
+    against the namespace (``user_ns``) of ``shell``.
+    """
+    names = ('add', 'remove', 'run', 'find', 'budget', 'show', 'cache')
+
+    def __init__(self, shell):
+        self.shell = shell
+
+    # XXX do we actually need this or can we do `user_ns` lookups?
+    def ns_eval(self, line):
+        '''Evalutate line in the embedded ns and return result
+        '''
+        ns = self.shell.user_ns
+        return eval(line, ns)
+
+    @property
+    def tt(self):
+        return self.ns_eval('_tree')
+
+    @property
+    def selection(self):
+        return self.tt._selection
+
+    @property
+    def tr(self):
+        return self.tt._tr
+
+    def err(self, msg="No tests selected"):
+        self.tt.err(msg)
+
+    def add(self, line):
+        '''Add tests from a test set to the current selection.
+
+        Usage:
+
+        add tt : add all tests in the current tree
+        add tt[4] : add 5th test in the current tree
+        add tt.tests[1:10] : add tests 1-9 found under the 'tests' module
+        '''
+        if line:
+            ts = self.ns_eval(line)
+            if ts:
+                self.selection.addtests(ts)
+            else:
+                raise TypeError("'{}' is not a test set".format(ts))
+        else:
+            print("No test set provided?")
+
+    def remove(self, line, delim=','):
+        """Remove tests from the current selection using a slice syntax
+        using a ',' delimiter instead of ':'.
+
+        Usage:
+
+        remove : remove all tests from the current selection
+        remove -1 : remove the last item from the selection
+        remove 1, : remove all but the first item (same as [1:])
+        remove ,,-3 : remove every third item (same as [::-3])
+        remove -m <regex> : remove all items who's node id matches <regex>
+        """
+        selection = self.selection
+        if not self.selection:
+            self.err()
+            return
+        if not line:
+            selection.clear()
+            return
+        if line.startswith('-m '):
+            pattern = line[3:].strip()
+            try:
+                count = selection.removematching(pattern)
+            except re.error as err:
+                self.err("'{}' is not a valid pattern: {}".format(
+                    pattern, err))
+                return
+            self.tr.write_line("Removed {} tests".format(count))
+            return
+        # parse out slice
+        if delim in line:
+            slc = slice(*map(lambda x: int(x.strip()) if x.strip() else None,
+                        line.split(delim)))
+            selection.removeitems(selection[slc])
+        else:  # just an index
+            try:
+                selection.remove(selection[int(line)])
+            except ValueError:
+                self.err("'{}' is not and index or slice?".format(line))
+
+    def run(self, line):
+        """Run tests and return to the shell once complete. The selection
+        and shell namespace are retained. Test modules are not reloaded so
+        edits to them only take effect after restarting ``pytest`` (parallel
+        runs use new worker processes and do pick them up).
+
+        Usage:
+
+            run : run the currently selected tests
+            run tt.tests : run all tests in the provided test set
+            run -n 8 [test set] : distribute the tests over 8 local worker
+                processes balanced by their previously recorded durations
+        """
+        if self.tt._collecting:
+            # the session's items are still being collected in the
+            # background
+            self.err("Tests can not be run until collection has completed")
+            return
+        tokens = line.split(None, 2)
+        nprocs = None
+        if tokens and tokens[0] == '-n':
+            try:
+                nprocs = int(tokens[1])
+            except (IndexError, ValueError):
+                self.err("'-n' requires a number of processes")
+                return
+            line = tokens[2] if len(tokens) > 2 else ''
+        if line:
+            items = self.ns_eval(line)._items
+        else:
+            items = list(self.selection.values())
+        if not items:
+            self.err()
+            return
+        from .runner import runtests, runtests_parallel
+        from .plugin import _suspend_capture
+        session = self.ns_eval('session')
+        try:
+            if nprocs:
+                results = runtests_parallel(session, items, nprocs)
+            else:
+                results = runtests(session, items)
+        except TypeError as err:
+            self.err(str(err))
+            return
+        finally:
+            # running tests resumes capturing of stdin
+            _suspend_capture(session.config)
+        for output in results.errors:
+            self.err("worker failed:\n{}".format(output))
+        self.tr.write_line("")
+        self.tr.write_line(results.summary(), bold=True)
+
+    def find(self, line):
+        """Return the test set of all tests who's node id contains a
+        substring or matches a regular expression or glob.
+
+        Usage:
+
+            find test_login : tests with 'test_login' in their node id
+            find -r login_[0-9]+ : tests matching a regular expression
+            find -g *api/*::test_get* : tests matching a glob (against the
+                whole node id)
+            x = %find login : assign the results to 'x'
+
+        To search within a test set use its ``find`` method
+        (i.e. ``tt.tests.find('login', regex=False, glob=False)``).
+        """
+        regex = glob = False
+        if line.startswith('-r '):
+            regex, line = True, line[3:]
+        elif line.startswith('-g '):
+            glob, line = True, line[3:]
+        pattern = line.strip()
+        if not pattern:
+            self.err("No pattern provided?")
+            return
+        try:
+            return self.tt._root.find(pattern, regex=regex, glob=glob)
+        except re.error as err:
+            self.err("'{}' is not a valid pattern: {}".format(pattern, err))
+
+    def budget(self, line):
+        """Fill the selection with the most valuable tests which fit within
+        a time budget as estimated from previously recorded durations.
+        Last failed tests are preferred, followed by new tests (with no
+        recorded duration), then the least often run and finally the
+        fastest tests.
+
+        Usage:
+
+            budget 5m : fill the selection with tests from ``tt`` such that
+                its estimated run time is at most 5 minutes
+            budget 1h30m tt.tests : only consider tests in ``tt.tests``
+        """
+        tokens = line.split(None, 1)
+        if not tokens:
+            self.err("No time budget provided?")
+            return
+        try:
+            budget = parse_duration(tokens[0])
+        except ValueError as err:
+            self.err(str(err))
+            return
+        testset = self.ns_eval(tokens[1]) if len(tokens) > 1 else \
+            self.tt._root
+        index = get_index(self.ns_eval('config'))
+        selection = self.selection
+        remaining = budget - index.estimate(selection.keys())
+        lastfailed = self.tt.get_cache_dict(path='cache/lastfailed')
+        stats = index.stats
+        mean = index.mean()
+
+        def priority(entry):
+            position, item = entry
+            stat = stats.get(item.nodeid)
+            return (item.nodeid not in lastfailed, stat is not None,
+                    stat[1] if stat else 0, stat[0] if stat else mean,
+                    position)
+
+        candidates = sorted(
+            ((position, item) for position, item in
+             enumerate(testset._items) if item.nodeid not in selection),
+            key=priority)
+        chosen = []
+        for position, item in candidates:
+            stat = stats.get(item.nodeid)
+            duration = stat[0] if stat else mean
+            if duration <= remaining:
+                remaining -= duration
+                chosen.append((position, item))
+        # keep collection order within the selection
+        for position, item in sorted(chosen, key=itemgetter(0)):
+            selection.append(item)
+        self.tr.write_line(
+            "Added {} tests, ~{} of the {} budget remains".format(
+                len(chosen), format_duration(max(remaining, 0)),
+                format_duration(budget)))
+
+    def show(self, line):
+        '''Show all currently selected test by pretty printing
+        to the console.
+
+        Usage:
+
+            show:  print currently selected tests
+            show tt.tests: print the tests in a test set
+            show -p 3: print the 3rd page of tests
+            show -d 2: only print collectors up to a depth of 2 along with
+                the number of tests beneath each
+            show -a: print all tests instead of a single page
+        '''
+        try:
+            opts, args = getopt.getopt(line.split(), 'ap:d:')
+        except getopt.GetoptError as err:
+            self.err(str(err))
+            return
+        opts = dict((opt.lstrip('-'), value) for opt, value in opts)
+        arg = ' '.join(args)
+        tree = self.tt
+        if arg:
+            itemids = list(self.ns_eval(arg)._ids())
+        else:
+            itemids = tree._itemids(self.selection.values())
+        try:
+            page = int(opts.get('p', 1))
+            depth = int(opts['d']) if 'd' in opts else None
+        except ValueError:
+            self.err("'-p' and '-d' require a number")
+            return
+        if page < 1 or (depth is not None and depth < 1):
+            self.err("'-p' and '-d' must be at least 1")
+            return
+        limit = None if 'a' in opts else tree.page_size
+        if not itemids:
+            self.err()
+            return
+        start = (page - 1) * (limit or 0)
+        if start >= len(itemids):
+            self.err("There are only {} page(s)".format(
+                -(-len(itemids) // limit)))
+            return
+        tree._tprint(None, start=start, limit=limit,
+                     depth=depth, itemids=itemids)
+
+    def cache(self, line, ident='pytest/interactive'):
+        """Store a set of tests in the pytest cache for retrieval in another
+        session.
+
+        Usage:
+
+            cache: show a summary of names previously stored in the cache.
+
+            cache del <name>: deletes the named entry from the cache.
+
+            cache add <name> <target>: stores the named tests as target name.
+        """
+        cachedict = self.tt.get_cache_dict()
+        if line:
+            tokens = line.split()
+            subcmd, name = tokens[0], tokens[1]
+
+            if subcmd == 'del':  # delete an entry
+                name = tokens[1]
+                self.tt.set_cache_items(name, None)  # delete
+                self.shell.user_ns.pop(name)
+                self.tr.write(
+                    "Deleted cache entry for '{}'\n".format(name))
+                return
+
+            elif subcmd == 'add':  # create a new entry
+                target = tokens[2]
+                if not re.match("[_A-Za-z][_a-zA-Z0-9]*$", target) \
+                        and not keyword.iskeyword(name):
+                    self.tt.err("'{}' is not a valid identifier"
+                                .format(target))
+                    return
+
+                testset = self.ns_eval(name)
+                self.tt.set_cache_items(target, testset)
+
+                # update the local shell's ns
+                if testset:
+                    self.shell.user_ns[target] = testset
+                self.tr.write(
+                    "Created cache entry for '{}'\n".format(name))
+                return
+
+            self.tt.err("'{}' is invalid. See %cache? for usage.".format(line))
+        else:
+            tr = self.tr
+            tr.write("\nSummary:\n", green=True)
+            for name, testnames in cachedict.items():
+                tr.write('{} -> {} items\n'.format(name, len(testnames)))
@@ -0,0 +1,642 @@
+"""
+Per test coverage recorded as an inverted index of the tests executing each
+source file (and line) used to select the tests impacted by changes
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import warnings
+import threading
+import subprocess
+import pytest
+from .bitset import Bitset
+from .index import _rootdir, _nodeid2file
+from .impact import git, git_error, git_changed
+from .plugin import Members
+
+COVERAGE_KEY = 'pytest-interactive/coverage'
+COVERAGE_VERSION = 1
+# tests which executed an unknown line of a file (i.e. recorded on a
+# previous version of it) are stored under this line number
+ANY_LINE = 0
+
+_monitoring = getattr(sys, 'monitoring', None)  # py3.12+
+_site_dirs = (os.sep + 'site-packages' + os.sep,
+              os.sep + 'dist-packages' + os.sep)
+_hunk_re = re.compile(r'^@@ -(\d+)(?:,(\d+))? ')
+# flag of the code objects of functions (not module or class bodies)
+CO_OPTIMIZED = 0x1
+
+
+def blob_digest(data):
+    """Return the git blob id of the file contents ``data``
+    """
+    header = 'blob {}\0'.format(len(data)).encode('ascii')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def _encode(bits):
+    return [bits.lo, '{:x}'.format(bits.mask)]
+
+
+def _decode(value):
+    return Bitset(value[0], int(value[1], 16))
+
+
+class Tracer(object):
+    """Record the lines (or only the files when ``lines`` is false) of the
+    python files under ``rootdir`` which are executed between ``start()``
+    and ``stop()``.
+
+    Only the lines of function bodies are recorded. Module and class
+    bodies usually run once on import (i.e. during collection) so their
+    lines can not be attributed to the tests depending on them.
+
+    ``sys.monitoring`` is used when available: code under ``rootdir``
+    receives local line events which are disabled after their first report
+    (or, when only recording files, after the code's first line) and
+    re-enabled for this tool only by the next ``start()``. Otherwise a
+    ``sys.settrace`` function is used which ignores frames outside
+    ``rootdir`` and stops tracing the lines of a function once all of them
+    have been recorded for the current test.
+    """
+    def __init__(self, rootdir, lines=True):
+        self.rootdir = os.path.abspath(rootdir) + os.sep
+        self.lines = lines
+        self.data = {}  # path (relative to rootdir) -> executed lines
+        self._paths = {}  # code filename -> relative path or None
+        # this package's own frames are never recorded
+        self._exclude = os.path.dirname(os.path.abspath(__file__)) + os.sep
+        self.backend = None  # 'sys.monitoring' or 'sys.settrace' once started
+        self._tool = None
+        self._active = False
+        self._codes = set()  # codes with local line events enabled
+        self._disabled = set()  # codes with local events to re-enable
+        self._previous = None  # trace function replaced while tracing
+        self._outside = set()  # codes which are never recorded
+        self._missing = {}  # code -> lines not yet recorded this test
+        self._trace = self._make_trace()
+
+    def _relpath(self, filename):
+        relpath = self._paths.get(filename, False)
+        if relpath is False:
+            path = os.path.abspath(filename)
+            relpath = None
+            if (path.startswith(self.rootdir) and path.endswith('.py') and
+                    not path.startswith(self._exclude) and
+                    not any(site in path for site in _site_dirs)):
+                relpath = path[len(self.rootdir):]
+            self._paths[filename] = relpath
+        return relpath
+
+    def _traced(self, code):
+        '''Return whether the lines of ``code`` (and not only its file)
+        are recorded
+        '''
+        return bool(self.lines and code.co_flags & CO_OPTIMIZED)
+
+    def _code_lines(self, code):
+        '''Lines of ``code`` reporting line events (excluding the line of
+        its definition)
+        '''
+        if not hasattr(code, 'co_lines'):  # py < 3.10
+            return _AnyLines()
+        return set(line for _, _, line in code.co_lines()
+                   if line and line != code.co_firstlineno)
+
+    def _make_trace(self):
+        # the state used by the trace function is bound to locals as it
+        # runs for every new frame while tracing
+        outside = self._outside
+        missing = self._missing
+        relpath_of = self._relpath
+        traced = self._traced
+        code_lines = self._code_lines
+        tracer = self
+
+        def trace(frame, event, arg):
+            # called for the 'call' event of every new frame
+            code = frame.f_code
+            if code in outside:
+                return None
+            entry = missing.get(code)
+            if entry is None:
+                relpath = relpath_of(code.co_filename)
+                if relpath is None:
+                    outside.add(code)
+                    return None
+                lines = tracer.data.get(relpath)
+                if lines is None:
+                    lines = tracer.data[relpath] = set()
+                todo = code_lines(code) if traced(code) else ()
+                entry = missing[code] = (todo, lines)
+            todo, lines = entry
+            if not todo:
+                # the file or all lines of the function are recorded
+                return None
+
+            def trace_lines(frame, event, arg):
+                if event == 'line':
+                    lineno = frame.f_lineno
+                    if lineno in todo:
+                        todo.discard(lineno)
+                        lines.add(lineno)
+                        if not todo:
+                            frame.f_trace_lines = False
+                return trace_lines
+            return trace_lines
+        return trace
+
+    def _py_start(self, code, offset):
+        if code not in self._codes:
+            if self._relpath(code.co_filename) is None:
+                return _monitoring.DISABLE
+            # executed lines are reported by local events which can be
+            # re-enabled without restarting the events of other tools
+            self._codes.add(code)
+            _monitoring.set_local_events(
+                self._tool, code, _monitoring.events.LINE)
+        return _monitoring.DISABLE
+
+    def _line(self, code, line):
+        self._disabled.add(code)
+        if not self._active:
+            return _monitoring.DISABLE
+        relpath = self._paths[code.co_filename]
+        lines = self.data.get(relpath)
+        if lines is None:
+            lines = self.data[relpath] = set()
+        if self._traced(code):
+            lines.add(line)
+        else:
+            # the file is recorded, ignore the code until the next test
+            _monitoring.set_local_events(self._tool, code, 0)
+        return _monitoring.DISABLE
+
+    def _free_tool(self):
+        for tool in (_monitoring.COVERAGE_ID, 3, 4):
+            if _monitoring.get_tool(tool) is None:
+                return tool
+        return None
+
+    def fallback(self):
+        """Return whether recording will use ``sys.settrace`` (i.e. no
+        ``sys.monitoring`` tool id is available)
+        """
+        if self._tool is not None:
+            return False
+        return _monitoring is None or self._free_tool() is None
+
+    def start(self):
+        if _monitoring is not None and self._tool is None:
+            tool = self._free_tool()
+            if tool is not None:
+                self._tool = tool
+                _monitoring.use_tool_id(tool, 'pytest-interactive')
+                events = _monitoring.events
+                _monitoring.register_callback(
+                    tool, events.PY_START, self._py_start)
+                _monitoring.register_callback(tool, events.LINE, self._line)
+                _monitoring.set_events(tool, events.PY_START)
+        self._active = True
+        self.backend = ('sys.settrace' if self._tool is None else
+                        'sys.monitoring')
+        if self._tool is not None:
+            # toggling a code's local events re-enables those it disabled
+            line = _monitoring.events.LINE
+            for code in self._disabled:
+                _monitoring.set_local_events(self._tool, code, 0)
+                _monitoring.set_local_events(self._tool, code, line)
+            self._disabled.clear()
+            return
+        self._previous = sys.gettrace()
+        threading.settrace(self._trace)
+        sys.settrace(self._trace)
+
+    def stop(self):
+        self._active = False
+        if self._tool is not None:
+            return
+        sys.settrace(self._previous)
+        threading.settrace(self._previous)
+        self._previous = None
+
+    def reset(self):
+        """Return the data recorded since the last reset and start over
+        """
+        data, self.data = self.data, {}
+        self._missing.clear()
+        return data
+
+    def close(self):
+        self._active = False
+        if self._tool is not None:
+            _monitoring.set_events(self._tool, 0)
+            for code in self._codes:
+                _monitoring.set_local_events(self._tool, code, 0)
+            self._codes.clear()
+            self._disabled.clear()
+            _monitoring.register_callback(
+                self._tool, _monitoring.events.PY_START, None)
+            _monitoring.register_callback(
+                self._tool, _monitoring.events.LINE, None)
+            _monitoring.free_tool_id(self._tool)
+            self._tool = None
+
+
+class _AnyLines(set):
+    '''The lines not yet recorded of a function whose lines are unknown
+    (py < 3.10) which is therefore traced in full
+    '''
+    def __contains__(self, line):
+        return True
+
+    def discard(self, line):
+        pass
+
+    def __bool__(self):
+        return True
+
+
+class CoverageMap(object):
+    """The tests which executed each file (and each line of it) decoded
+    from the cache on first use.
+
+    Each test is identified by its index in ``tests``. For every file the
+    ids of the tests which executed it are stored as a ``Bitset`` along
+    with the lines grouped by the set of tests which executed them.
+
+    Changes which can not be attributed to lines (such as module level
+    code run on import) select the tests importing the changed file
+    according to the ``ImportGraph`` ``graph``.
+    """
+    def __init__(self, config, graph=None):
+        self.config = config
+        self.graph = graph
+        self.rootdir = _rootdir(config)
+        self._loaded = False
+        self.mode = None
+        self.head = None  # git commit the coverage was recorded at
+        self.tests = []
+        self.files = {}  # path -> [stamp, digest, tests, {line: tests}]
+        # content hash of each file of the import graph when recorded
+        self.imports = None
+        self._changes = {}  # git ref -> results of ``_change_set()``
+
+    def load(self):
+        if self._loaded:
+            return self
+        self._loaded = True
+        cache = getattr(self.config, 'cache', None)
+        entry = cache.get(COVERAGE_KEY, None) if cache else None
+        if not entry or entry.get('version') != COVERAGE_VERSION:
+            return self
+        self.mode = entry['mode']
+        self.head = entry.get('head')
+        self.tests = entry['tests']
+        self.imports = entry.get('imports')
+        for relpath, value in entry['files'].items():
+            lines = {}
+            for bits, numbers in value['lines']:
+                bits = _decode(bits)
+                for line in numbers:
+                    lines[line] = bits
+            self.files[relpath] = [value['stamp'], value['digest'],
+                                   _decode(value['tests']), lines]
+        return self
+
+    def dump(self):
+        files = {}
+        for relpath, (stamp, digest, tests, lines) in self.files.items():
+            groups = {}
+            for line, bits in lines.items():
+                groups.setdefault(bits, []).append(line)
+            files[relpath] = {
+                'stamp': stamp,
+                'digest': digest,
+                'tests': _encode(tests),
+                'lines': [[_encode(bits), sorted(numbers)]
+                          for bits, numbers in groups.items()],
+            }
+        return {
+            'version': COVERAGE_VERSION,
+            'mode': self.mode,
+            'head': self.head,
+            'tests': self.tests,
+            'files': files,
+            'imports': self.imports,
+        }
+
+    def _nodeids(self, bits):
+        tests = self.tests
+        return [tests[i] for i in bits]
+
+    def _key(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.rootdir)
+        return os.path.normpath(path)
+
+    def touched(self, path, lines=None):
+        """Return the node ids of the tests which executed the file at
+        ``path`` or, if provided, any of its ``lines``
+        """
+        entry = self.load().files.get(self._key(path))
+        if entry is None:
+            return []
+        if lines is None or self.mode != 'lines':
+            return self._nodeids(entry[2])
+        if isinstance(lines, int):
+            lines = (lines,)
+        return self._nodeids(self._lines(entry, lines))
+
+    def _lines(self, entry, lines):
+        # tests recorded on an older version of the file may have
+        # executed any line
+        bylines = entry[3]
+        bits = bylines.get(ANY_LINE, Bitset())
+        for line in lines:
+            bits |= bylines.get(line, Bitset())
+        return bits
+
+    def _modified(self, relpath, entry):
+        '''Return whether the file differs from when it was recorded
+        '''
+        path = os.path.join(self.rootdir, relpath)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        if [st.st_mtime, st.st_size] == entry[0]:
+            return False
+        with open(path, 'rb') as f:
+            return blob_digest(f.read()) != entry[1]
+
+    def _diff(self, base, relpaths):
+        '''Map each of ``relpaths`` which differs from the git ``base`` to
+        the base's blob id and the lines changed relative to it
+        '''
+        top = git(self.rootdir, 'rev-parse', '--show-toplevel')[0]
+        paths = [os.path.join(self.rootdir, relpath) for relpath in relpaths]
+        output = git(self.rootdir, '-c', 'core.quotePath=false', 'diff',
+                     '-U0', '--full-index', '--no-renames', base, '--',
+                     *paths)
+        changes = {}
+        blob = lines = None
+        for text in output:
+            if text.startswith('diff --git'):
+                blob = lines = None
+            elif text.startswith('index '):
+                blob = text.split()[1].split('..')[0]
+            elif text.startswith('--- a/'):
+                relpath = os.path.relpath(
+                    os.path.join(top, text[6:].rstrip('\t')), self.rootdir)
+                lines = set()
+                changes[relpath] = blob, lines
+            elif lines is not None:
+                match = _hunk_re.match(text)
+                if match:
+                    start = int(match.group(1))
+                    count = int(match.group(2) or 1)
+                    # lines inserted after ``start`` touch both neighbours
+                    lines.update(range(start, start + (count or 2)))
+        return changes
+
+    def _change_set(self, since):
+        '''Return the ids of the tests which executed changed lines and the
+        modified files whose changes could not be attributed to lines
+        '''
+        if since in self._changes:
+            return self._changes[since]
+        files = self.load().files
+        modified = set(relpath for relpath, entry in files.items()
+                       if self._modified(relpath, entry))
+        base = since or self.head
+        diff = {}
+        try:
+            if since:
+                # also those changed between ``since`` and the recording
+                modified.update(
+                    set(files) & git_changed(self.rootdir, since))
+            if modified and base and self.mode == 'lines':
+                diff = self._diff(base, sorted(modified))
+        except (OSError, subprocess.CalledProcessError) as err:
+            if since:
+                raise pytest.UsageError("--ia-changed-since {}: {}".format(
+                    since, git_error(err)))
+        bits = Bitset()
+        coarse = set()
+        for relpath in modified:
+            entry = files[relpath]
+            change = diff.get(relpath)
+            if (change and change[0] == entry[1] and
+                    all(line in entry[3] for line in change[1])):
+                bits |= self._lines(entry, change[1])
+            else:
+                bits |= entry[2]
+                coarse.add(relpath)
+        self._changes[since] = bits, coarse
+        return bits, coarse
+
+    def changed(self, since=None, testfiles=None):
+        """Return the node ids of the tests which executed code that changed
+        since the coverage was recorded and the test modules of
+        ``testfiles`` which import a file with changes not attributed to
+        lines.
+
+        Lines changed relative to the git ref ``since`` (by default the
+        commit the coverage was recorded at) only select the tests which
+        executed them when the file was recorded at that revision and every
+        changed line is in a function body executed by a test. Otherwise
+        (i.e. module level changes) any test which executed the modified
+        file, or imports it, is selected.
+        """
+        if not self.load().tests:
+            return [], set()
+        bits, coarse = self._change_set(since)
+        nodeids = self._nodeids(bits)
+        graph = self.graph
+        if graph is None or not testfiles:
+            return nodeids, set()
+        graph.update(testfiles)
+        # files which no test executed (or only on import) changed
+        changed = graph.changed(since, baseline=self.imports or None)
+        coarse = coarse | (changed - set(self.files))
+        return nodeids, graph.impacted(testfiles, coarse)
+
+    def query(self, tree):
+        """Return the ``touched`` function of the shell's namespace
+        """
+        def touched(path, lines=None):
+            """Return the test set of the tests which executed the file at
+            ``path`` (relative to the rootdir) or, if provided, any of its
+            ``lines`` (a line number or a sequence of them) when the
+            coverage was recorded with ``--ia-coverage``.
+            """
+            if not self.load().tests:
+                return tree.err(
+                    "No coverage recorded, run the tests with --ia-coverage")
+            return tree._subset(self.touched(path, lines))
+        return touched
+
+    def testset(self, tree):
+        """Return the test set of ``tree`` impacted by changed code
+        """
+        since = self.config.getoption('ia_changed_since', None)
+        return tree._testset(
+            tree._root._path, members=ChangedMembers(self, since))
+
+    def merge(self, runs, stamps):
+        """Replace the coverage of each test in ``runs`` (a map of node ids
+        to the lines they executed per file) with the new results.
+        ``stamps`` maps each recorded file to its current stamp and digest.
+        """
+        self.load()
+        tests = self.tests
+        ids = dict((nodeid, i) for i, nodeid in enumerate(tests))
+        for nodeid in runs:
+            if nodeid not in ids:
+                ids[nodeid] = len(tests)
+                tests.append(nodeid)
+        rerun = Bitset.from_ids(ids[nodeid] for nodeid in runs)
+        # group the tests which executed the same lines of each file
+        groups = {}
+        for nodeid, data in runs.items():
+            for relpath, lines in data.items():
+                groups.setdefault(relpath, {}).setdefault(
+                    lines, []).append(ids[nodeid])
+        for relpath in set(self.files) | set(groups):
+            stamp, digest, old, bylines = self.files.get(
+                relpath, (None, None, Bitset(), {}))
+            old -= rerun
+            bylines = dict((line, bits - rerun)
+                           for line, bits in bylines.items())
+            new = stamps.get(relpath)
+            if new is not None and new[1] != digest and old:
+                # the line numbers recorded for the remaining tests no
+                # longer match the file's contents
+                bylines = {ANY_LINE: old}
+            tests_bits = old
+            for lines, testids in groups.get(relpath, {}).items():
+                bits = Bitset.from_ids(testids)
+                tests_bits |= bits
+                for line in lines:
+                    bylines[line] = bylines.get(line, Bitset()) | bits
+            if not tests_bits:
+                self.files.pop(relpath, None)
+                continue
+            if new is not None:
+                stamp, digest = new
+            self.files[relpath] = [stamp, digest, tests_bits, dict(
+                (line, bits) for line, bits in bylines.items() if bits)]
+
+
+class ChangedMembers(Members):
+    '''Members of the tests impacted by changed code resolved against the
+    tree's items whenever new ones are indexed
+    '''
+    def __init__(self, covmap, since=None):
+        Members.__init__(self)
+        self.covmap = covmap
+        self.since = since
+
+    def mask(self, tree):
+        if self._version != tree._version:
+            tree._refresh()
+            files = [_nodeid2file(item.nodeid) for item in tree._funcitems]
+            nodeids, modules = self.covmap.changed(self.since, set(files))
+            ids = set(tree._nodeids2ids(nodeids))
+            ids.update(i for i, relpath in enumerate(files)
+                       if relpath in modules)
+            self._mask = Bitset.from_ids(ids)
+            self._version = tree._version
+        return self._mask
+
+
+class CoverageRecorder(object):
+    """Plugin recording the files and lines executed by each test
+    (including its setup and teardown) and merging the results into the
+    coverage map in the cache when the session finishes.
+    """
+    def __init__(self, config, lines=True):
+        self.config = config
+        self.rootdir = _rootdir(config)
+        self.mode = 'lines' if lines else 'files'
+        self.tracer = Tracer(self.rootdir, lines=lines)
+        if self.tracer.fallback():
+            warning = pytest.PytestWarning(
+                "--ia-coverage records with sys.settrace since "
+                "sys.monitoring (Python 3.12+) is unavailable; expect tests "
+                "to run several times slower")
+            issue = getattr(config, 'issue_config_time_warning', None)
+            if issue is not None:
+                issue(warning, stacklevel=2)
+            else:
+                warnings.warn(warning)
+        self._linesets = {}  # interned sets of executed lines
+        self.runs = {}  # node id -> {path: lines}
+        self.elapsed = 0.  # time spent running traced tests
+
+    def _intern(self, lines):
+        lines = frozenset(lines)
+        return self._linesets.setdefault(lines, lines)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        tracer = self.tracer
+        start = time.time()
+        tracer.start()
+        yield
+        tracer.stop()
+        self.elapsed += time.time() - start
+        data = tracer.reset()
+        self.runs[item.nodeid] = dict(
+            (relpath, self._intern(lines)) for relpath, lines in data.items())
+
+    def _stamps(self):
+        stamps = {}
+        paths = set()
+        for data in self.runs.values():
+            paths.update(data)
+        for relpath in paths:
+            path = os.path.join(self.rootdir, relpath)
+            try:
+                st = os.stat(path)
+                with open(path, 'rb') as f:
+                    digest = blob_digest(f.read())
+            except (IOError, OSError):
+                continue
+            stamps[relpath] = [st.st_mtime, st.st_size], digest
+        return stamps
+
+    def pytest_sessionfinish(self, session):
+        self.tracer.close()
+        cache = getattr(self.config, 'cache', None)
+        if cache is None or not self.runs:
+            return
+        covmap = CoverageMap(self.config).load()
+        if covmap.mode != self.mode:
+            # the map is rebuilt when switching between files and lines
+            covmap.tests, covmap.files = [], {}
+        covmap.mode = self.mode
+        graph = self.config.pluginmanager.getplugin('interactive-imports')
+        if graph is not None:
+            # snapshot the imported files to detect module level changes
+            graph.update(graph.testfiles)
+            imports = covmap.imports or {}
+            imports.update(graph.digests())
+            covmap.imports = imports
+        try:
+            covmap.head = git(self.rootdir, 'rev-parse', 'HEAD')[0]
+        except (OSError, subprocess.CalledProcessError):
+            covmap.head = None
+        covmap.merge(self.runs, self._stamps())
+        cache.set(COVERAGE_KEY, covmap.dump())
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.runs:
+            terminalreporter.write_line(
+                "pytest-interactive: recorded {} coverage of {} tests with "
+                "{} ({:.2f}s)".format(self.mode, len(self.runs),
+                                      self.tracer.backend, self.elapsed))
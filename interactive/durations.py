@@ -0,0 +1,116 @@
+"""
+Per test durations recorded across sessions in the pytest cache
+"""
+import re
+
+DURATIONS_KEY = 'pytest-interactive/durations'
+
+_duration_re = re.compile(
+    r'^(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m)?(?:(\d+(?:\.\d+)?)s?)?$')
+
+
+def parse_duration(text):
+    """Parse a duration such as ``90``, ``5m`` or ``1h30m`` into seconds
+    """
+    text = text.replace(' ', '').lower()
+    match = _duration_re.match(text)
+    if not text or not match:
+        raise ValueError("'{}' is not a valid duration".format(text))
+    hours, minutes, seconds = (float(value or 0) for value in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_duration(seconds):
+    """Render seconds as a short human readable string
+    """
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return '{}m{:02d}s'.format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m'.format(hours, minutes)
+
+
+class DurationIndex(object):
+    """Plugin recording the duration (summed over the setup, call and
+    teardown phases) and number of runs of every test. Results are kept in
+    memory for the session and persisted to the cache when it finishes.
+    """
+    def __init__(self, config):
+        self.config = config
+        self._stats = None
+        self._phases = {}  # durations of the test currently running
+        self._mean = None
+        self._dirty = False
+        self.version = 0  # bumped whenever a duration is recorded
+
+    @property
+    def stats(self):
+        """Mapping of node ids to ``[duration, runs]`` pairs
+        """
+        if self._stats is None:
+            cache = getattr(self.config, 'cache', None)
+            stats = cache.get(DURATIONS_KEY, {}) if cache else {}
+            self._stats = dict(
+                (nodeid, value if isinstance(value, list) else [value, 1])
+                for nodeid, value in stats.items())
+        return self._stats
+
+    def duration(self, nodeid, default=None):
+        entry = self.stats.get(nodeid)
+        return entry[0] if entry else default
+
+    def runs(self, nodeid):
+        entry = self.stats.get(nodeid)
+        return entry[1] if entry else 0
+
+    def durations(self):
+        """Return a dict of node ids to their last recorded duration
+        """
+        return dict((nodeid, entry[0])
+                    for nodeid, entry in self.stats.items())
+
+    def mean(self, default=1.):
+        stats = self.stats
+        if not stats:
+            return default
+        if self._mean is None:
+            self._mean = sum(
+                entry[0] for entry in stats.values()) / len(stats)
+        return self._mean
+
+    def estimate(self, nodeids):
+        """Estimated total run time of the provided tests where tests
+        without a recorded duration are assumed to take the mean
+        """
+        stats = self.stats
+        mean = self.mean()
+        total = 0.
+        for nodeid in nodeids:
+            entry = stats.get(nodeid)
+            total += entry[0] if entry else mean
+        return total
+
+    def pytest_runtest_logreport(self, report):
+        nodeid = report.nodeid
+        self._phases[nodeid] = (
+            self._phases.get(nodeid, 0.) + getattr(report, 'duration', 0.))
+        if report.when == 'teardown':
+            runs = self.runs(nodeid)
+            self.stats[nodeid] = [self._phases.pop(nodeid), runs + 1]
+            self._mean = None
+            self._dirty = True
+            self.version += 1
+
+    def pytest_sessionfinish(self, session):
+        cache = getattr(self.config, 'cache', None)
+        if self._dirty and cache is not None:
+            cache.set(DURATIONS_KEY, self.stats)
+            self._dirty = False
+
+
+def get_index(config):
+    """Return the session's ``DurationIndex`` or ``None`` if not registered
+    """
+    return config.pluginmanager.getplugin('interactive-durations')
@@ -0,0 +1,377 @@
+"""
+Static import graph of the test modules used to select the tests affected
+by changed source files
+"""
+import os
+import ast
+import hashlib
+import subprocess
+import pytest
+from .bitset import Bitset
+from .index import _rootdir, _nodeid2file
+from .plugin import Members
+
+IMPORTS_KEY = 'pytest-interactive/imports'
+GRAPH_VERSION = 1
+
+
+def _imports(source, filename):
+    '''Return the ``(module, level, names)`` of each import statement in
+    ``source`` (including those nested in functions and conditionals)
+    '''
+    try:
+        tree = ast.parse(source, filename)
+    except (SyntaxError, ValueError, TypeError):
+        return []
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, 0, ()) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append((node.module or '', node.level or 0, tuple(
+                alias.name for alias in node.names if alias.name != '*')))
+    return imports
+
+
+def _resolve(base, parts):
+    '''Return the files executed by importing the dotted ``parts`` from the
+    directory ``base`` along with the directory of the final package (or
+    ``None`` if the last part is a module, an attribute or not found)
+    '''
+    files = []
+    path = base
+    for part in parts:
+        path = os.path.join(path, part)
+        init = os.path.join(path, '__init__.py')
+        if os.path.isfile(init):
+            files.append(init)
+        elif os.path.isfile(path + '.py'):
+            files.append(path + '.py')
+            return files, None
+        elif not os.path.isdir(path):  # else a namespace package
+            return files, None
+    return files, path
+
+
+def git(rootdir, *args):
+    """Run git in ``rootdir`` returning its output lines
+    """
+    output = subprocess.check_output(
+        ('git',) + args, cwd=rootdir, stderr=subprocess.STDOUT)
+    return output.decode('utf-8').splitlines()
+
+
+def git_error(err):
+    """Describe the failure of a ``git`` call
+    """
+    output = getattr(err, 'output', None)
+    return output.decode('utf-8').strip() if output else str(err)
+
+
+def git_changed(rootdir, ref):
+    """Return the paths (relative to ``rootdir``) of files which differ
+    from the git ``ref`` in the work tree along with any untracked files
+    """
+    top = git(rootdir, 'rev-parse', '--show-toplevel')[0]
+    names = git(rootdir, 'diff', '--name-only', ref, '--')
+    names += git(rootdir, 'ls-files', '--others', '--exclude-standard',
+                 '--full-name')
+    return set(os.path.relpath(os.path.join(top, name), rootdir)
+               for name in names)
+
+
+class ImportGraph(object):
+    """Plugin maintaining the graph of imports between the files under the
+    rootdir reachable from the collected test modules (and the
+    ``conftest.py`` files above them).
+
+    The content hash and resolved imports of every file are kept in the
+    cache keyed by the file's mtime and size such that only files which
+    changed since the previous session are hashed and parsed again. When
+    a session which ran tests finishes the hash of every file is recorded
+    as the baseline which later sessions are compared against.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.rootdir = _rootdir(config)
+        cache = getattr(config, 'cache', None)
+        entry = cache.get(IMPORTS_KEY, None) if cache else None
+        if not entry or entry.get('version') != GRAPH_VERSION:
+            entry = {}
+        # path -> [mtime, size, digest, imported paths] (relative paths)
+        self._files = entry.get('files', {})
+        self.baseline = entry.get('baseline')  # path -> digest
+        self.testfiles = set()  # test modules seen this session
+        self._checked = set()  # paths which are up to date this session
+        self._conftests = {}  # directory -> its conftest.py or None
+        self._roots = None
+        self._memo = {}  # (module, names) -> resolved absolute imports
+        self._changed = {}  # git ref -> changed paths
+        self._dirty = False
+        self._ran = False
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.rootdir)
+
+    def roots(self):
+        """Directories absolute imports are resolved against: entries of
+        ``sys.path`` within the rootdir, the base directory of each test
+        module's package (as inserted by ``pytest``) and the rootdir
+        """
+        if self._roots is None:
+            import sys
+            rootdir = self.rootdir
+            roots = []
+            for path in sys.path:
+                path = os.path.abspath(path or os.curdir)
+                if (path not in roots and os.path.isdir(path) and
+                        (path + os.sep).startswith(rootdir + os.sep)):
+                    roots.append(path)
+            for relpath in sorted(self.testfiles):
+                path = os.path.dirname(os.path.join(rootdir, relpath))
+                while os.path.isfile(os.path.join(path, '__init__.py')):
+                    path = os.path.dirname(path)
+                if path not in roots:
+                    roots.append(path)
+            if rootdir not in roots:
+                roots.append(rootdir)
+            self._roots = roots
+        return self._roots
+
+    def _resolve_import(self, filename, module, level, names):
+        parts = module.split('.') if module else []
+        if level:
+            base = os.path.dirname(filename)
+            for _ in range(level - 1):
+                base = os.path.dirname(base)
+            bases = [base]
+        else:
+            key = (module, names)
+            if key in self._memo:
+                return self._memo[key]
+            bases = self.roots()
+        files = []
+        for base in bases:
+            files, package = _resolve(base, parts)
+            if not files and package is None:
+                continue
+            if package is not None:
+                # imported names may be sub-modules
+                for name in names:
+                    files.extend(_resolve(package, [name])[0])
+            break
+        if not level:
+            self._memo[key] = files
+        return files
+
+    def _deps(self, path, source):
+        '''Return the paths (relative to the rootdir) of the files imported
+        by the module at ``path``
+        '''
+        rootdir = self.rootdir + os.sep
+        deps = set()
+        # modules within a package first import its ``__init__``
+        init = os.path.join(os.path.dirname(path), '__init__.py')
+        if init != path and os.path.isfile(init):
+            deps.add(init)
+        for module, level, names in _imports(source, path):
+            deps.update(self._resolve_import(path, module, level, names))
+        deps.discard(path)
+        return sorted(self._rel(dep) for dep in deps
+                      if dep.startswith(rootdir))
+
+    def _check(self, relpath):
+        '''Bring the entry of ``relpath`` up to date returning ``None`` if
+        the file no longer exists
+        '''
+        path = os.path.join(self.rootdir, relpath)
+        entry = self._files.get(relpath)
+        try:
+            st = os.stat(path)
+        except OSError:
+            if entry is not None:
+                del self._files[relpath]
+                self._dirty = True
+            return None
+        stamp = [st.st_mtime, st.st_size]
+        if entry is not None and entry[:2] == stamp:
+            return entry
+        with open(path, 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha1(source).hexdigest()
+        if entry is not None and entry[2] == digest:
+            entry[:2] = stamp  # touched but not modified
+        else:
+            deps = self._deps(path, source) if path.endswith('.py') else []
+            entry = self._files[relpath] = stamp + [digest, deps]
+        self._dirty = True
+        return entry
+
+    def _conftest(self, directory):
+        if directory not in self._conftests:
+            path = os.path.join(directory, 'conftest.py')
+            self._conftests[directory] = (
+                self._rel(path) if os.path.isfile(path) else None)
+        return self._conftests[directory]
+
+    def conftests(self, relpath):
+        """Paths of the ``conftest.py`` files which apply to the test module
+        at ``relpath``
+        """
+        rootdir = self.rootdir
+        path = os.path.dirname(os.path.join(rootdir, relpath))
+        found = []
+        while (path + os.sep).startswith(rootdir + os.sep):
+            conftest = self._conftest(path)
+            if conftest is not None:
+                found.append(conftest)
+            if path == rootdir:
+                break
+            path = os.path.dirname(path)
+        return found
+
+    def update(self, relpaths):
+        """Bring the entries of ``relpaths``, the files they (transitively)
+        import and their conftests up to date
+        """
+        relpaths = set(relpaths)
+        if not relpaths <= self.testfiles:
+            self.testfiles = self.testfiles | relpaths
+            self._roots = None
+            self._memo.clear()
+        stack = [relpath for relpath in relpaths
+                 if relpath not in self._checked]
+        for relpath in relpaths:
+            stack.extend(self.conftests(relpath))
+        checked = self._checked
+        while stack:
+            relpath = stack.pop()
+            if relpath in checked:
+                continue
+            checked.add(relpath)
+            entry = self._check(relpath)
+            if entry is not None:
+                stack.extend(dep for dep in entry[3] if dep not in checked)
+
+    def digest(self, relpath):
+        entry = self._files.get(relpath)
+        return entry[2] if entry else None
+
+    def changed(self, since=None, baseline=None):
+        """Return the paths of the files which changed since the git ref
+        ``since`` or, by default, since the ``baseline`` hashes (those of
+        the last session which ran tests unless provided). All files are
+        considered changed without a baseline.
+        """
+        if since:
+            if since not in self._changed:
+                try:
+                    self._changed[since] = git_changed(self.rootdir, since)
+                except (OSError, subprocess.CalledProcessError) as err:
+                    raise pytest.UsageError("--ia-changed-since {}: {}".format(
+                        since, git_error(err)))
+            return self._changed[since]
+        if baseline is None:
+            baseline = self.baseline
+        if baseline is None:
+            return set(self._checked)
+        return set(relpath for relpath in self._checked
+                   if self.digest(relpath) != baseline.get(relpath))
+
+    def digests(self):
+        """Map the path of every up to date file to its content hash
+        """
+        return dict((relpath, self.digest(relpath))
+                    for relpath in self._checked if relpath in self._files)
+
+    def impacted(self, relpaths, changed):
+        """Return the test modules of ``relpaths`` which import (directly or
+        transitively), or are, one of the ``changed`` files or are beneath
+        a changed ``conftest.py``
+        """
+        self.update(relpaths)
+        if not changed:
+            return set()
+        importers = {}
+        for relpath in self._checked:
+            entry = self._files.get(relpath)
+            for dep in entry[3] if entry else ():
+                importers.setdefault(dep, []).append(relpath)
+        for relpath in relpaths:
+            for conftest in self.conftests(relpath):
+                importers.setdefault(conftest, []).append(relpath)
+        seen = set(changed)
+        stack = list(seen)
+        while stack:
+            for importer in importers.get(stack.pop(), ()):
+                if importer not in seen:
+                    seen.add(importer)
+                    stack.append(importer)
+        return set(relpaths) & seen
+
+    def affected(self, relpaths, since=None):
+        """Return the test modules of ``relpaths`` impacted by the files
+        which changed (see ``changed()``)
+        """
+        self.update(relpaths)
+        return self.impacted(relpaths, self.changed(since))
+
+    def testset(self, tree):
+        """Return the test set of ``tree`` affected by the changed files
+        """
+        since = self.config.getoption('ia_changed_since', None)
+        members = AffectedMembers(self, since)
+        return tree._testset(tree._root._path, members=members)
+
+    def pytest_collection_modifyitems(self, items):
+        # before any selection is made (and rebound rather than updated
+        # since with ``--ia-stream`` this runs in the collection thread)
+        self.testfiles = self.testfiles | set(
+            _nodeid2file(item.nodeid) for item in items)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtestloop(self, session):
+        yield
+        self._ran = self._ran or bool(
+            session.items and not session.config.option.collectonly)
+
+    def pytest_sessionfinish(self, session):
+        cache = getattr(self.config, 'cache', None)
+        if cache is None:
+            return
+        if self._ran:
+            self.update(self.testfiles)
+            baseline = self.baseline or {}
+            for relpath in self._checked:
+                digest = self.digest(relpath)
+                if digest is None:
+                    baseline.pop(relpath, None)
+                else:
+                    baseline[relpath] = digest
+            self.baseline = baseline
+            self._dirty = True
+        if self._dirty:
+            cache.set(IMPORTS_KEY, {
+                'version': GRAPH_VERSION,
+                'files': self._files,
+                'baseline': self.baseline,
+            })
+
+
+class AffectedMembers(Members):
+    '''Members of the tests in modules affected by the changed files which
+    are resolved whenever new items are indexed
+    '''
+    def __init__(self, graph, since=None):
+        Members.__init__(self)
+        self.graph = graph
+        self.since = since
+
+    def mask(self, tree):
+        if self._version != tree._version:
+            files = [_nodeid2file(item.nodeid) for item in tree._funcitems]
+            affected = self.graph.affected(set(files), self.since)
+            self._mask = Bitset.from_ids(
+                i for i, relpath in enumerate(files) if relpath in affected)
+            self._version = tree._version
+        return self._mask
@@ -0,0 +1,250 @@
+"""
+Persist the test tree index in the pytest cache such that tests can be
+selected before collection in a later session
+"""
+import os
+import json
+import hashlib
+from collections import namedtuple
+from .plugin import TestTree, FuncCollection
+
+INDEX_VERSION = 1
+# number of indices (of distinct invocations) kept in the cache
+INDEX_HISTORY = 4
+# kinds of indexed tree nodes
+NODE, FUNCS, OTHER = 'node', 'funcs', 'other'
+Callspec = namedtuple('Callspec', 'id')
+
+
+def _rootdir(config):
+    return str(getattr(config, 'rootpath', None) or config.rootdir)
+
+
+def _resolve(arg, invdir):
+    """Resolve the path of a positional argument (optionally followed by
+    ``::`` and a node name) against the invocation directory
+    """
+    parts = arg.split('::', 1)
+    parts[0] = os.path.normpath(os.path.join(invdir, parts[0]))
+    return '::'.join(parts)
+
+
+def _index_name(config):
+    """File name of the index for the current invocation. Only the rootdir
+    and the collected paths determine the tests while options (including
+    the ``--ia-select`` expressions) do not.
+    """
+    params = getattr(config, 'invocation_params', None)
+    invdir = str(getattr(params, 'dir', None) or os.getcwd())
+    paths = sorted(set(_resolve(str(arg), invdir) for arg in config.args))
+    ident = json.dumps([_rootdir(config), paths])
+    return 'index-{}.json'.format(
+        hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16])
+
+
+def _index_dir(config):
+    cache = config.cache
+    mkdir = getattr(cache, 'mkdir', None) or cache.makedir
+    return str(mkdir('pytest-interactive'))
+
+
+def _nodeid2file(nodeid):
+    return nodeid.split('::', 1)[0]
+
+
+def _stamps(rootdir, relpaths, exclude=()):
+    """Map each of the provided files as well as their parent directories
+    below ``rootdir`` to its mtime. Directory mtimes change whenever a
+    file is added to or removed from them. Neither ``rootdir`` (whose
+    mtime changes with any new file next to the tests) nor anything in
+    the ``exclude`` directories (such as the cache) is stamped.
+    """
+    paths = set()
+    for relpath in relpaths:
+        path = os.path.dirname(os.path.join(rootdir, relpath))
+        while (path not in paths and path != rootdir and
+               path.startswith(rootdir)):
+            paths.add(path)
+            path = os.path.dirname(path)
+        paths.add(os.path.join(rootdir, relpath))
+    stamps = {}
+    for path in paths:
+        if any(path == d or path.startswith(d + os.sep) for d in exclude):
+            continue
+        try:
+            stamps[os.path.relpath(path, rootdir)] = os.stat(path).st_mtime
+        except OSError:
+            pass
+    return stamps
+
+
+class CachedNode(object):
+    """Stand in for a pytest collector loaded from a cached index
+    """
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+class CachedItem(object):
+    """Stand in for a pytest item loaded from a cached index
+    """
+    def __init__(self, nodeid, name, text, chain, path, callspec_id=None):
+        self.nodeid = nodeid
+        self.name = name
+        self.text = text
+        self.parent = chain[-1]
+        self._chain = chain
+        self._path = path
+        if callspec_id is not None:
+            self.callspec = Callspec(callspec_id)
+
+    def listchain(self):
+        return self._chain + [self]
+
+    def __repr__(self):
+        return self.text
+
+
+class CachedTestTree(TestTree):
+    """A ``TestTree`` built from a cached index instead of collected items
+    """
+    def __init__(self, funcitems, termrep, shell, selection, config,
+                 lazy=False, nodes=None):
+        self._cachednodes = nodes
+        super(CachedTestTree, self).__init__(
+            funcitems, termrep, shell, selection, config)
+
+    @classmethod
+    def from_index(cls, index, termrep, shell, selection, config):
+        nodes, chains = {}, {}
+        paths = []
+        for path, name, text, kind in index['nodes']:
+            path = tuple(path)
+            if kind == FUNCS:
+                node = FuncCollection()
+                node.name = name
+            else:
+                node = CachedNode(name, text)
+            nodes[path] = node
+            paths.append(path)
+            # the pytest node chain excludes any synthesized nodes
+            chain = chains.get(path[:-1], [])
+            chains[path] = chain + [node] if kind == NODE else chain
+        items = []
+        for nodeid, pathindex, name, text, csid in index['items']:
+            parent = paths[pathindex]
+            item = CachedItem(
+                nodeid, name, text, chains[parent], parent + (name,), csid)
+            if isinstance(nodes[parent], FuncCollection):
+                nodes[parent].append(item)
+            items.append(item)
+        return cls(items, termrep, shell, selection, config, nodes=nodes)
+
+    def _gennodes(self, itemid, item):
+        path = item._path
+        nodes = self._cachednodes
+        for i in range(1, len(path)):
+            yield path[:i], nodes[path[:i]]
+        yield path, item
+
+
+def dump_index(tree, exclude=()):
+    """Serialize the tree's paths and items to a json compatible dict
+    """
+    tree._materialize(tree._root._path, subtree=True)
+    leaves = set(tree._leafpaths)
+    nodes, pathindex = [], {}
+    for path, node in tree._nodes.items():
+        if path in leaves:
+            continue
+        if isinstance(node, FuncCollection):
+            kind = FUNCS
+        elif hasattr(node, 'listchain'):
+            kind = NODE
+        else:
+            kind = OTHER
+        pathindex[path] = len(nodes)
+        nodes.append([list(path), path[-1], repr(node), kind])
+    items = []
+    for item, path in zip(tree._funcitems, tree._leafpaths):
+        cs = getattr(item, 'callspec', None)
+        items.append([item.nodeid, pathindex[path[:-1]], path[-1],
+                      repr(item), cs.id if cs else None])
+    rootdir = _rootdir(tree._config)
+    files = set(_nodeid2file(item.nodeid) for item in tree._funcitems)
+    return {
+        'version': INDEX_VERSION,
+        'stamps': _stamps(rootdir, files, exclude),
+        'nodes': nodes,
+        'items': items,
+    }
+
+
+def save_index(tree):
+    """Write the tree's index for this invocation and remove all but the
+    ``INDEX_HISTORY`` most recently saved indices of other invocations
+    """
+    config = tree._config
+    # create the cache directory before stamping its parents
+    dirpath = _index_dir(config)
+    cachedir = os.path.dirname(os.path.dirname(dirpath))
+    path = os.path.join(dirpath, _index_name(config))
+    with open(path, 'w') as f:
+        json.dump(dump_index(tree, exclude=(cachedir,)), f)
+    others = []
+    for name in os.listdir(dirpath):
+        other = os.path.join(dirpath, name)
+        if (name.startswith('index-') and name.endswith('.json') and
+                other != path):
+            try:
+                others.append((os.stat(other).st_mtime, other))
+            except OSError:
+                pass
+    for _, other in sorted(others, reverse=True)[INDEX_HISTORY - 1:]:
+        try:
+            os.remove(other)
+        except OSError:
+            pass
+
+
+def load_index(config):
+    """Return the cached index for this invocation or ``None`` if missing
+    or any of the indexed test files or directories has changed since
+    """
+    path = os.path.join(_index_dir(config), _index_name(config))
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+    if not index or index.get('version') != INDEX_VERSION:
+        return None
+    rootdir = _rootdir(config)
+    for relpath, mtime in index['stamps'].items():
+        try:
+            if os.stat(os.path.join(rootdir, relpath)).st_mtime != mtime:
+                return None
+        except OSError:
+            return None
+    return index
+
+
+def selected_paths(config, nodeids):
+    """Return the absolute paths of all files containing the provided
+    node ids and each of their parent directories
+    """
+    rootdir = _rootdir(config)
+    paths = set()
+    for nodeid in nodeids:
+        path = os.path.abspath(os.path.join(rootdir, _nodeid2file(nodeid)))
+        while path not in paths:
+            paths.add(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return paths
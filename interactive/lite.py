@@ -0,0 +1,205 @@
+"""
+A minimal shell built on the standard library's ``code`` and ``readline``
+modules which starts without importing IPython
+"""
+import re
+import code
+import inspect
+import rlcompleter
+from .commands import (SelectionCommands, TreeCompleter, prompt_parts,
+                       exit_message)
+from .timing import phase
+
+try:
+    import readline
+except ImportError:  # not available on all platforms
+    readline = None
+
+# a command such as ``show -p 2``, ``%add tt.tests``, ``x = %find login``
+# or ``remove?`` (the rest of the line must not look like an expression
+# using the command's name as a variable)
+_command_re = re.compile(
+    r"^\s*(?:([A-Za-z_]\w*)\s*=\s*(?=%))?(%?)([A-Za-z_]\w*)(\?)?"
+    r"(?:\s+(?![=(.\[])(.*?))?\s*$")
+_exit_re = re.compile(r"^\s*(exit|quit)(?:\(\))?\s*$")
+
+
+class LiteShell(code.InteractiveConsole):
+    """Drop in replacement for ``PytestShellEmbed`` which supports the same
+    namespace, test set completion, prompt and selection commands (which,
+    as with IPython's automagic, may be entered without a ``%`` prefix
+    unless their name is shadowed by a variable).
+    """
+    # path of the readline history file
+    pytest_hist_file = None
+    # ``PhaseTimer`` of the session when ``--ia-profile`` is set
+    pytest_timer = None
+    history_length = 1000
+
+    def __init__(self, banner1=''):
+        code.InteractiveConsole.__init__(self)
+        self.banner1 = banner1
+        self.selection = None
+        self.keep_running = True
+        self.commands = SelectionCommands(self)
+        self.completer = TreeCompleter(self)
+        self._matches = []
+        with phase(self.pytest_timer, 'history'):
+            self._load_history()
+
+    @property
+    def user_ns(self):
+        return self.locals
+
+    def _load_history(self):
+        if readline is None or not self.pytest_hist_file:
+            return
+        try:
+            readline.read_history_file(self.pytest_hist_file)
+        except (IOError, OSError):  # no history yet
+            pass
+
+    def _save_history(self):
+        if readline is None or not self.pytest_hist_file:
+            return
+        readline.set_history_length(self.history_length)
+        try:
+            readline.write_history_file(self.pytest_hist_file)
+        except (IOError, OSError):
+            pass
+
+    def __call__(self, header='', local_ns=None):
+        """Enter the shell with ``local_ns`` as its namespace and block
+        until the user exits
+        """
+        self.locals = local_ns if local_ns is not None else {}
+        self._rlcompleter = rlcompleter.Completer(self.locals)
+        state = None
+        if readline is not None:
+            state = readline.get_completer(), readline.get_completer_delims()
+            readline.set_completer(self.complete)
+            # complete on '.' and '[' chains of test set lookups
+            readline.set_completer_delims(
+                ' \t\n`~!@#$%^&*()=+{}\\|;:",<>/?')
+            if 'libedit' in (readline.__doc__ or ''):
+                readline.parse_and_bind('bind ^I rl_complete')
+            else:
+                readline.parse_and_bind('tab: complete')
+        try:
+            self.interact('\n'.join(
+                line for line in (self.banner1, header) if line))
+        finally:
+            if state is not None:
+                readline.set_completer(state[0])
+                readline.set_completer_delims(state[1])
+            self._save_history()
+
+    def prompt(self):
+        return ''.join(prompt_parts(self.locals))
+
+    def interact(self, banner=None):
+        self.keep_running = True
+        if banner:
+            print(banner)
+        more = False
+        while self.keep_running:
+            try:
+                line = self.raw_input('... ' if more else self.prompt())
+            except EOFError:
+                print('')
+                self.resetbuffer()
+                more = False
+                self.exit()
+                continue
+            except KeyboardInterrupt:
+                self.write('\nKeyboardInterrupt\n')
+                self.resetbuffer()
+                more = False
+                continue
+            more = self.push(line)
+
+    def push(self, line):
+        if not self.buffer and self.runcommand(line):
+            return False
+        return code.InteractiveConsole.push(self, line)
+
+    def runcommand(self, line):
+        """Run ``line`` if it is a selection command (or an exit request)
+        and return whether it was handled
+        """
+        ns = self.locals
+        match = _exit_re.match(line)
+        if match and match.group(1) not in ns:
+            self.exit()
+            return True
+        match = _command_re.match(line)
+        if not match:
+            return False
+        target, prefix, name, help, arg = match.groups()
+        if name not in SelectionCommands.names or (
+                not prefix and name in ns):
+            return False
+        command = getattr(self.commands, name)
+        if help:
+            print(inspect.getdoc(command))
+            return True
+        try:
+            result = command(arg or '')
+        except Exception:
+            self.showtraceback()
+            return True
+        if target:
+            ns[target] = result
+        elif result is not None:
+            ns['_'] = result
+            print(repr(result))
+        return True
+
+    def complete(self, text, state):
+        """``readline`` completer of test set lookups falling back to
+        ``rlcompleter`` and command names
+        """
+        if state == 0:
+            self._matches = self._complete(text)
+        if state < len(self._matches):
+            return self._matches[state]
+        return None
+
+    def _complete(self, text):
+        line = readline.get_line_buffer()[:readline.get_endidx()]
+        result = self.completer.complete(line)
+        if result is not None:
+            fragment, keys = result
+            base = text[:len(text) - len(fragment)]
+            return [base + key for key in keys]
+        if not text.strip():
+            return []
+        matches = []
+        if line.strip() == text:
+            # the first word may be a command
+            matches.extend(name + ' ' for name in SelectionCommands.names
+                           if name.startswith(text))
+        self._rlcompleter.complete(text, 0)
+        matches.extend(getattr(self._rlcompleter, 'matches', ()))
+        return matches
+
+    def ask_yes_no(self, prompt, default=None):
+        answers = {'y': True, 'yes': True, 'n': False, 'no': False}
+        while True:
+            try:
+                answer = self.raw_input(prompt + ' ').strip().lower()
+            except EOFError:
+                print('')
+                answer = ''
+                if default is None:
+                    raise
+            answer = answer or default
+            if answer in answers:
+                return answers[answer]
+
+    def exit(self):
+        """Handle interactive exit prompting the user to verify the current
+        test selection
+        """
+        if self.ask_yes_no(exit_message(self), 'y'):
+            self.keep_running = False
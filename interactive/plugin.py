@@ -1,11 +1,17 @@
 import pytest
-import math
-import errno
 import re
 import os
+import sys
+import functools
+import threading
+from array import array
+from bisect import bisect_left
 from os.path import expanduser, join
-from operator import attrgetter, itemgetter
-from collections import OrderedDict, namedtuple
+from operator import attrgetter, and_, or_, sub, xor
+from collections import OrderedDict, namedtuple, deque
+from .bitset import Bitset, compact
+from .durations import DurationIndex, get_index, format_duration
+from .timing import get_timer, phase, shell_time
 
 
 def pytest_addoption(parser):
@@ -13,71 +19,454 @@ def pytest_addoption(parser):
                      dest='interactive',
                      help="enable iteractive selection of tests after"
                      " collection")
-
-
-@pytest.hookimpl(trylast=True)
-def pytest_collection_modifyitems(session, config, items):
-    """called after collection has been performed, may filter or re-order
-    the items in-place.
-    """
-    if not (config.option.interactive and items):
-        return
-
+    parser.addoption("--ia-lazy", action="store_true", dest='ia_lazy',
+                     help="only index the collector hierarchy up front and"
+                     " index the tests under each module/class on first use")
+    parser.addoption("--ia-cached", action="store_true", dest='ia_cached',
+                     help="select tests from the tree index cached by a"
+                     " previous session before collection and only collect"
+                     " the files containing the selected tests")
+    parser.addoption("--ia-stream", action="store_true", dest='ia_stream',
+                     help="enter the shell immediately and add tests to the"
+                     " tree as they are collected")
+    parser.addoption("--ia-profile", action="store", dest='ia_profile',
+                     nargs='?', const='phases', default=None,
+                     choices=('phases', 'cprofile'),
+                     help="report the time spent in each phase of starting"
+                     " the shell and store it in the cache; 'cprofile' also"
+                     " profiles the startup")
+    parser.addoption("--ia-shell", action="store", dest='ia_shell',
+                     default='ipython', choices=('ipython', 'lite'),
+                     help="shell backend; 'lite' is a minimal shell built on"
+                     " the standard library which starts without importing"
+                     " IPython")
+    parser.addoption("--ia-select", action="append", dest='ia_select',
+                     default=[], metavar='EXPR',
+                     help="select the tests in the test set EXPR (i.e."
+                     " 'tt.tests.params.a' or 'lastfailed') without entering"
+                     " the shell (or as the shell's initial selection with"
+                     " --ia); may be given multiple times")
+    parser.addoption("--ia-changed-since", action="store",
+                     dest='ia_changed_since', default=None, metavar='REF',
+                     help="the 'affected' and 'changed' test sets hold the"
+                     " tests impacted by files which differ from the git"
+                     " REF instead of those changed since the last session"
+                     " that ran tests (or since coverage was recorded)")
+    parser.addoption("--ia-coverage", action="store", dest='ia_coverage',
+                     nargs='?', const='lines', default=None,
+                     choices=('lines', 'files'),
+                     help="record the source lines (or only the files)"
+                     " executed by each test in the cache for the 'changed'"
+                     " test set and 'touched()' queries")
+
+
+def pytest_configure(config):
+    # record test durations for estimates and ``%budget``
+    config.pluginmanager.register(
+        DurationIndex(config), 'interactive-durations')
+    if config.getoption('ia_select', None) and config.option.ia_stream:
+        raise pytest.UsageError(
+            "--ia-select can not be used with --ia-stream")
+    coverage = config.getoption('ia_coverage', None)
+    if coverage:
+        from .coverage_map import CoverageRecorder
+        config.pluginmanager.register(
+            CoverageRecorder(config, lines=coverage == 'lines'),
+            'interactive-coverage')
+    interactive = config.getoption('interactive', False)
+    if interactive or coverage or config.getoption('ia_select', None):
+        # import graph of the test modules for the ``affected`` test set
+        from .impact import ImportGraph
+        config.pluginmanager.register(
+            ImportGraph(config), 'interactive-imports')
+    if interactive:
+        # keep the time spent in the shell out of the session duration
+        from .timing import SessionTimer
+        config._ia_session_timer = SessionTimer(config)
+        config.pluginmanager.register(
+            config._ia_session_timer, 'interactive-session-timer')
+    profile = config.getoption('ia_profile', None)
+    if profile and interactive:
+        from .timing import PhaseTimer
+        config._ia_timer = PhaseTimer(config, cprofile=profile == 'cprofile')
+        config.pluginmanager.register(config._ia_timer, 'interactive-timer')
+
+
+def _suspend_capture(config):
     capman = config.pluginmanager.getplugin("capturemanager")
     if capman:
         if getattr(capman, 'suspendcapture', False):
             capman.suspendcapture(in_=True)
         else:
             capman.suspend_global_capture(in_=True)
+    return capman
 
-    tr = config.pluginmanager.getplugin('terminalreporter')
 
-    from .shell import PytestShellEmbed, SelectionMagics
-    # prep a separate ipython history file
-    fname = 'shell_history.sqlite'
-    confdir = join(expanduser('~'), '.config', 'pytest_interactive')
-    try:
-        os.makedirs(confdir)
-    except OSError as e:  # py2 compat
-        if e.errno == errno.EEXIST:
-            pass
+def _resume_capture(capman):
+    if capman:
+        if getattr(capman, 'resumecapture', False):
+            capman.resumecapture()
         else:
-            raise
+            capman.resume_global_capture()
 
-    selection = FuncCollection()
 
-    PytestShellEmbed.pytest_hist_file = join(confdir, fname)
-    ipshell = PytestShellEmbed(banner1='Entering IPython shell...')
-    ipshell.register_magics(SelectionMagics)
+def _make_shell(selection, config=None):
+    timer = get_timer(config)
+    backend = config.getoption('ia_shell', 'ipython') if config else 'ipython'
+    # prep a separate history file
+    confdir = join(expanduser('~'), '.config', 'pytest_interactive')
+    os.makedirs(confdir, exist_ok=True)
+
+    if backend == 'lite':
+        with phase(timer, 'import'):
+            from .lite import LiteShell
+        LiteShell.pytest_hist_file = join(confdir, 'lite_history')
+        LiteShell.pytest_timer = timer
+        with phase(timer, 'shell'):
+            shell = LiteShell(banner1='Entering lite shell...')
+        shell.selection = selection
+        return shell
+
+    with phase(timer, 'import'):
+        from .shell import (PytestShellEmbed, SelectionMagics,
+                            register_completer)
+    PytestShellEmbed.pytest_hist_file = join(confdir, 'shell_history.sqlite')
+    PytestShellEmbed.pytest_timer = timer
+    with phase(timer, 'shell'):
+        ipshell = PytestShellEmbed(banner1='Entering IPython shell...')
+        ipshell.register_magics(SelectionMagics)
+        register_completer(ipshell)
     # shell needs ref to curr selection
     ipshell.selection = selection
+    return ipshell
 
-    # build a tree of test items
-    tr.write_line("Building test tree...")
-    # test tree needs ref to shell
-    tree = TestTree(items, tr, ipshell, selection, config)
 
-    intro = """Welcome to pytest-interactive, the pytest + IPython sensation!\n
-Please explore the collected test tree using tt.<TAB>
-HINT: when finished tabbing to a test node, simply __call__() it to have
-pytest invoke all tests collected under that node."""
-
-    user_ns = {
+def _namespace(session, config, tree, headless=False):
+    """Return the namespace in which test sets are selected
+    """
+    if headless:
+        # an empty set instead of reporting a missing cache entry
+        lastfailed = tree._subset(
+            list(tree.get_cache_dict(path='cache/lastfailed')))
+    else:
+        lastfailed = tree.get_cache_items(path='cache/lastfailed')
+    ns = {
         '_tree': tree,
         'tt': tree._root,
-        'shell': ipshell,
+        'shell': tree._shell,
         'config': config,
         'session': session,
-        '_selection': selection,
-        'lastfailed': tree.get_cache_items(path='cache/lastfailed'),
+        '_selection': tree._selection,
+        'lastfailed': lastfailed,
     }
+    graph = config.pluginmanager.getplugin('interactive-imports')
+    if graph is not None:
+        ns['affected'] = graph.testset(tree)
+    # per test coverage recorded by ``--ia-coverage``
+    from .coverage_map import CoverageMap
+    covmap = CoverageMap(config, graph)
+    ns['touched'] = covmap.query(tree)
+    ns['changed'] = covmap.testset(tree)
 
     # preload cached test sets
     for name, testnames in tree.get_cache_dict().items():
-        user_ns[name] = tree.get_cache_items(key=name)
+        ns[name] = tree.get_cache_items(key=name)
+    return ns
+
+
+def _select(config, tree, ns):
+    """Add the tests of each ``--ia-select`` expression evaluated in ``ns``
+    to the tree's selection
+    """
+    for expr in config.option.ia_select:
+        try:
+            testset = eval(expr, ns)
+        except Exception as err:
+            raise pytest.UsageError("--ia-select '{}' failed: {}: {}".format(
+                expr, type(err).__name__, err))
+        if not isinstance(testset, TestSet):
+            raise pytest.UsageError(
+                "--ia-select '{}' is not a test set".format(expr))
+        tree._selection.addtests(testset)
+
+
+def _select_headless(session, config, tree):
+    """Select tests using only the ``--ia-select`` expressions
+    """
+    ns = _namespace(session, config, tree, headless=True)
+    _select(config, tree, ns)
+
+
+def _interact(session, config, tree):
+    """Embed the shell on top of ``tree`` and block until the user exits
+    """
+    intro = """Welcome to pytest-interactive, the pytest + IPython sensation!\n
+Please explore the collected test tree using tt.<TAB>
+HINT: when finished tabbing to a test node, simply __call__() it to have
+pytest invoke all tests collected under that node."""
+
+    timer = get_timer(config)
+    with phase(timer, 'cache'):
+        user_ns = _namespace(session, config, tree)
+
+    # seed the selection
+    _select(config, tree, user_ns)
+
+    if timer:
+        option = config.option
+        mode = ('stream' if option.ia_stream else
+                'cached' if option.ia_cached else
+                'lazy' if option.ia_lazy else 'eager')
+        timer.finish(tree._tr, items=len(tree._funcitems), mode=mode)
 
     # embed and block until user exits
-    ipshell(intro, local_ns=user_ns)
+    with shell_time(config, concurrent=tree._collecting):
+        tree._shell(intro, local_ns=user_ns)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection(session):
+    """When ``--ia-cached`` is set and a valid tree index from a previous
+    session is found in the cache, select tests *before* collection such
+    that only the files containing the selected tests are collected.
+    """
+    config = session.config
+    interactive = config.option.interactive
+    if not (interactive or config.option.ia_select):
+        return
+    if interactive and config.option.ia_stream:
+        return _stream_collect(session)
+    if not config.option.ia_cached:
+        return
+
+    from .index import CachedTestTree, load_index
+    tr = config.pluginmanager.getplugin('terminalreporter')
+    with phase(get_timer(config), 'index'):
+        index = load_index(config)
+    if index is None:
+        tr.write_line("No valid cached test index, collecting...")
+        return
+
+    selection = FuncCollection()
+    if not interactive:
+        tree = CachedTestTree.from_index(index, tr, None, selection, config)
+        _select_headless(session, config, tree)
+        config._ia_preselected = list(selection.keys())
+        return
+
+    capman = _suspend_capture(config)
+    tr.write_line("Loading cached test tree...")
+    ipshell = _make_shell(selection, config)
+    with phase(get_timer(config), 'index'):
+        tree = CachedTestTree.from_index(index, tr, ipshell, selection, config)
+    _interact(session, config, tree)
+    # only collect files containing the selected tests
+    config._ia_preselected = list(selection.keys())
+    _resume_capture(capman)
+
+
+class StreamCollector(object):
+    """Plugin which feeds the items from each collection report into a
+    ``TestTree`` as they arrive and, once collection completes, waits for
+    the shell to exit before applying its selection
+    """
+    def __init__(self, tree, config):
+        self.tree = tree
+        self.config = config
+        self.exited = threading.Event()
+        # verbosity of the terminal reporter while the shell is open
+        self.verbose = None
+
+    def quiet(self):
+        """Keep the terminal reporter's (tty) collection progress from
+        clobbering the shell
+        """
+        option = self.config.option
+        if self.verbose is None:
+            self.verbose = option.verbose
+            option.verbose = min(option.verbose, -1)
+
+    def restore(self):
+        if self.verbose is not None:
+            self.config.option.verbose, self.verbose = self.verbose, None
+
+    @pytest.hookimpl(hookwrapper=True, trylast=True)
+    def pytest_make_collect_report(self, collector):
+        # the capture manager resumes global capturing (including stdin)
+        # around collecting each file which would take the shell's input
+        # and output, so suspend it again (within the capture manager's
+        # wrapper) until the shell has exited
+        if not self.exited.is_set():
+            _suspend_capture(self.config)
+        yield
+
+    def pytest_collectreport(self, report):
+        if report.passed:
+            items = [node for node in report.result
+                     if isinstance(node, pytest.Item)]
+            if items:
+                self.tree.extend(items)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, config, items):
+        self.tree._collecting = False
+        self.restore()
+        self.exited.wait()
+        # submit final selection from the fully collected (and possibly
+        # deselected) items in collection order (the selection is ordered
+        # by the arrival of collection reports)
+        nodeids = set(self.tree._selection.keys())
+        selected = [item for item in items if item.nodeid in nodeids]
+        _deselect(config, items, selected)
+        items[:] = selected
+
+
+def _collection_hooks(config):
+    """Return a caller of the other plugins' ``pytest_collection``
+    implementations (e.g. assertion rewriting and the terminal reporter)
+    leaving out pytest's own (which the streamed collection replaces) and
+    the wrappers which already wrap this call
+    """
+    hook = config.hook.pytest_collection
+    exclude = [config.pluginmanager.getplugin('main'), sys.modules[__name__]]
+    exclude.extend(
+        impl.plugin for impl in hook.get_hookimpls()
+        if impl.hookwrapper or getattr(impl, 'wrapper', False))
+    return config.pluginmanager.subset_hook_caller(
+        'pytest_collection', exclude)
+
+
+def _stream_collect(session):
+    """Run collection in a background thread while the shell is running
+    in the main thread.
+    """
+    config = session.config
+    tr = config.pluginmanager.getplugin('terminalreporter')
+    selection = FuncCollection()
+    tree = TestTree([], tr, _make_shell(selection, config), selection,
+                    config, lazy=config.option.ia_lazy,
+                    root_name=session.name)
+    collector = StreamCollector(tree, config)
+    collector.quiet()
+    result = _collection_hooks(config)(session=session)
+    if result is not None:
+        collector.restore()
+        return result
+    capman = _suspend_capture(config)
+    config.pluginmanager.register(collector, 'interactive-stream')
+    config._ia_streaming = True
+    errors = []
+
+    def collect():
+        try:
+            session.perform_collect()
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            tree._collecting = False
+
+    tree._collecting = True
+    thread = threading.Thread(target=collect, name='ia-collect')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        _interact(session, config, tree)
+    finally:
+        collector.restore()
+        collector.exited.set()
+
+    if tree._collecting:
+        tr.write_line("Waiting for collection to complete...")
+    thread.join()
+    config.pluginmanager.unregister(collector)
+    _resume_capture(capman)
+    if errors:
+        raise errors[0]
+    return True
+
+
+def _ignore_collect(path, config):
+    nodeids = getattr(config, '_ia_preselected', None)
+    if nodeids is None:
+        return
+    allowed = getattr(config, '_ia_allowed', None)
+    if allowed is None:
+        from .index import selected_paths
+        allowed = config._ia_allowed = selected_paths(config, nodeids)
+    path = os.path.abspath(str(path))
+    if path in allowed:
+        return
+    # keep package ``__init__`` modules of any permitted directory
+    if (os.path.basename(path) == '__init__.py' and
+            os.path.dirname(path) in allowed):
+        return
+    return True
+
+
+if getattr(pytest, 'version_tuple', (0,)) >= (7,):
+    def pytest_ignore_collect(collection_path, config):
+        return _ignore_collect(collection_path, config)
+else:
+    def pytest_ignore_collect(path, config):
+        return _ignore_collect(path, config)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(session, config, items):
+    """called after collection has been performed, may filter or re-order
+    the items in-place.
+    """
+    interactive = config.option.interactive
+    if not ((interactive or config.option.ia_select) and items):
+        return
+    if getattr(config, '_ia_streaming', False):
+        # selection is made while collection is still running
+        return
+
+    nodeids = getattr(config, '_ia_preselected', None)
+    if nodeids is not None:
+        # selection was already made on the cached tree
+        byid = dict((item.nodeid, item) for item in items)
+        selected = [byid[nodeid] for nodeid in nodeids if nodeid in byid]
+        if not interactive:
+            _deselect(config, items, selected)
+        items[:] = selected
+        return
+
+    tr = config.pluginmanager.getplugin('terminalreporter')
+    if not interactive:
+        tree = TestTree(items, tr, None, FuncCollection(), config,
+                        lazy=config.option.ia_lazy)
+        if config.option.ia_cached:
+            from .index import save_index
+            save_index(tree)
+        _select_headless(session, config, tree)
+        selected = list(tree._selection.values())
+        _deselect(config, items, selected)
+        items[:] = selected
+        return
+
+    timer = get_timer(config)
+    if timer:
+        timer.stop('collection')
+    capman = _suspend_capture(config)
+    selection = FuncCollection()
+    ipshell = _make_shell(selection, config)
+
+    # build a tree of test items
+    tr.write_line("Building test tree...")
+    # test tree needs ref to shell
+    with phase(timer, 'tree'):
+        tree = TestTree(items, tr, ipshell, selection, config,
+                        lazy=config.option.ia_lazy)
+
+    if config.option.ia_cached:
+        from .index import save_index
+        with phase(timer, 'index'):
+            save_index(tree)
+
+    _interact(session, config, tree)
 
     # submit final selection
     if selection:
@@ -85,76 +474,131 @@ pytest invoke all tests collected under that node."""
     else:
         items[:] = []
 
-    if capman:
-        if getattr(capman, 'resumecapture', False):
-            capman.resumecapture
-        else:
-            capman.resume_global_capture()
+    _resume_capture(capman)
+
+
+def _deselect(config, items, selected):
+    """Report the tests in ``items`` which are not ``selected``
+    """
+    selected = set(item.nodeid for item in selected)
+    deselected = [item for item in items if item.nodeid not in selected]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
 
 
 _root_ids = ('.', '')
+# ``Instance`` nodes were dropped in pytest 7
+_Instance = getattr(pytest, 'Instance', ())
 Package = namedtuple('Package', 'name path node parent')
 
 
-def gen_nodes(item, cache, root_name):
+def _node_entries(node, path, cache, root_name):
+    '''Return the ``(path, node)`` entries contributed by the collector
+    ``node`` given the ``path`` of its parent
+    '''
+    if isinstance(node, _Instance):
+        # leave out Instances, later versions 'should' drop them
+        return ()
+    try:
+        name = node.name.replace(os.path.sep, '.')
+        if '.py' in name:
+            name = name.rstrip('.py')
+    except AttributeError as ae:
+        if node.nodeid in _root_ids:
+            name = root_name
+        else:  # XXX should never get here
+            raise ae
+    # packaged module
+    if '.' in name and isinstance(node, pytest.Module):
+        # FIXME: this should be cwd dependent!!!
+        # (i.e. don't add package objects we're below in the fs)
+        prefix = tuple(name.split('.'))
+        lpath = node.fspath
+        fspath = str(lpath)
+        entries = []
+        # don't include the mod name in path
+        for level in prefix[:-1]:
+            path += (level,)
+            # one flyweight per package path shared by all its items
+            package = cache.get(path)
+            if package is None:
+                name = '{}{}'.format(fspath[:fspath.index(level)], level)
+                package = Package(name, lpath, node, node.parent)
+            entries.append((path, package))
+        name = prefix[-1]  # this mod's name
+        entries.append((path + (name,), node))
+        return tuple(entries)
+    return ((path + (name,), node),)
+
+
+def _collector_entries(collector, memo, cache, root_name):
+    '''Return the ``(path, node)`` entries of ``collector`` and all of its
+    ancestors (root first). Each collector is processed once; its entries
+    are stored in ``memo`` and extended by each of its children.
+    '''
+    entries = memo.get(collector)
+    if entries is not None:
+        return entries
+    # walk up to the nearest already processed ancestor
+    chain = []
+    node = collector
+    while node is not None and node not in memo:
+        chain.append(node)
+        node = node.parent
+    entries = memo[node] if node is not None else ()
+    for node in reversed(chain):
+        path = entries[-1][0] if entries else ()
+        entries = memo[node] = entries + _node_entries(
+            node, path, cache, root_name)
+    return entries
+
+
+def gen_nodes(item, cache, root_name, memo=None):
     '''generate all parent objs of this node up to the root/session
+
+    ``memo`` maps each collector seen so far to its entries such that
+    the ancestors shared by sibling items are only processed once.
     '''
-    path = ()
-    # pytest node api - lists path items in order
-    chain = item.listchain()
-    for node in chain:
-        # when either Instance or non-packaged module
-        if isinstance(node, pytest.Instance):
-            # leave out Instances, later versions 'should' drop them
-            continue
+    if memo is None:
+        memo = {}
+    if not isinstance(item, pytest.Item):
+        for entry in _collector_entries(item, memo, cache, root_name):
+            yield entry
+        return
+    entries = _collector_entries(item.parent, memo, cache, root_name)
+    for entry in entries:
+        yield entry
+    path = entries[-1][0] if entries else ()
+    for entry in gen_item_nodes(item, path, cache):
+        yield entry
+
+
+def gen_item_nodes(item, path, cache):
+    '''generate the nodes for a test item given the path of its parent
+    '''
+    name = item.name
+    if '[' in name:
+        funcname = name.split('[')[0]
         try:
-            name = node.name.replace(os.path.sep, '.')
-            if '.py' in name:
-                name = name.rstrip('.py')
-        except AttributeError as ae:
-            if node.nodeid in _root_ids:
-                name = root_name
-            else:  # XXX should never get here
-                raise ae
-        # packaged module
-        if '.' in name and isinstance(node, pytest.Module):
-            # FIXME: this should be cwd dependent!!!
-            # (i.e. don't add package objects we're below in the fs)
-            prefix = tuple(name.split('.'))
-            lpath = node.fspath
-            fspath = str(lpath)
-            # don't include the mod name in path
-            for level in prefix[:-1]:
-                name = '{}{}'.format(fspath[:fspath.index(level)], level)
-                path += (level,)
-                yield path, Package(name, lpath, node, node.parent)
-            name = prefix[-1]  # this mod's name
-        # func item
-        elif isinstance(node, pytest.Item):
-            name = node.name
-            if '[' in name:
-                funcname = name.split('[')[0]
-                try:
-                    # TODO: look up the pf based on the vanilla func obj
-                    # (should be an attr on the _pyfuncitem...)
-                    pf = cache[path + (funcname,)]
-                except KeyError:
-                    # parametrized func is a collection of funcs
-                    pf = FuncCollection()
-                    pf.name = funcname
-                    pf.parent = node.parent  # set parent like other nodes
-                pf.append(node)
-                path += (funcname,)
-                yield path, pf
-        # all other nodes
-        path += (name,)
-        yield path, node
+            # TODO: look up the pf based on the vanilla func obj
+            # (should be an attr on the _pyfuncitem...)
+            pf = cache[path + (funcname,)]
+        except KeyError:
+            # parametrized func is a collection of funcs
+            pf = FuncCollection()
+            pf.name = funcname
+            pf.parent = item.parent  # set parent like other nodes
+        pf.append(item)
+        # share the collection's name string across all of its items' paths
+        path += (pf.name,)
+        yield path, pf
+    yield path + (name,), item
 
 
 def dirinfo(obj):
     """return relevant __dir__ info for obj
     """
-    return sorted(set(dir(type(obj)) + list(obj.__dict__.keys())))
+    return sorted(set(dir(type(obj)) + list(getattr(obj, '__dict__', ()))))
 
 
 def tosymbol(ident):
@@ -169,11 +613,138 @@ def tosymbol(ident):
     return ident
 
 
+class LRUCache(object):
+    """A bounded mapping which evicts the least recently used entries once
+    more than ``maxsize`` entries are stored or the weight charged to them
+    exceeds ``maxweight``. ``evict`` is called with each evicted value.
+    """
+    def __init__(self, maxsize=1024, maxweight=None, evict=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.evict = evict
+        self.weight = 0
+        self._data = OrderedDict()
+        self._weights = {}
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._pop(key)
+        self._data[key] = value
+        self._shrink()
+
+    def charge(self, key, value, weight):
+        """Add ``weight`` to the entry at ``key`` if ``value`` is (still)
+        stored there
+        """
+        if self._data.get(key) is not value:
+            return
+        self._weights[key] = self._weights.get(key, 0) + weight
+        self.weight += weight
+        self._data.move_to_end(key)
+        self._shrink()
+
+    def _shrink(self):
+        data = self._data
+        while len(data) > self.maxsize or (
+                self.maxweight is not None and self.weight > self.maxweight
+                and len(data) > 1):
+            self._pop(next(iter(data)))
+
+    def _pop(self, key):
+        value = self._data.pop(key, None)
+        self.weight -= self._weights.pop(key, 0)
+        if value is not None and self.evict is not None:
+            self.evict(value)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        while self._data:
+            self._pop(next(iter(self._data)))
+
+
+def memoized(meth):
+    """Cache the result of a no-argument method in the instance's
+    ``_memo`` dict
+    """
+    name = meth.__name__
+
+    @functools.wraps(meth)
+    def wrapper(self):
+        tree = self._tree
+        tree._refresh()
+        memo = self._memo
+        if memo.get(_version) != tree._version:
+            # the tree has grown since results were cached
+            memo.clear()
+            memo[_version] = tree._version
+        try:
+            return memo[name]
+        except KeyError:
+            result = memo[name] = meth(self)
+            if isinstance(result, list):
+                # bound the item references held by interned views
+                tree._cache.charge(self._key, self, len(result))
+            return result
+    return wrapper
+
+
+_version = object()  # memo key of the tree version
+
+
+def _forget(testset):
+    '''Drop the memoized results of a view evicted from the tree's cache
+    (they are recomputed if it is still in use)
+    '''
+    testset._memo.clear()
+
+
+def _prefixed(keys, prefix):
+    '''Return the keys in the sorted list ``keys`` starting with ``prefix``
+    '''
+    matches = []
+    for i in range(bisect_left(keys, prefix), len(keys)):
+        key = keys[i]
+        if not key.startswith(prefix):
+            break
+        matches.append(key)
+    return matches
+
+
+def _indkey(indices):
+    """Return a hashable key for a ``TestSet`` index or slice
+    """
+    if isinstance(indices, slice):
+        return (indices.start, indices.stop, indices.step)
+    return indices
+
+
 class FuncCollection(object):
-    '''A selection of functions
+    '''A selection of functions kept as an ordered set keyed by node id.
+
+    Items are stored in insertion order in an array along with a map of
+    each key to its position. Removal leaves a tombstone (``None``) in the
+    array which is compacted away in a single pass on the next positional
+    access such that indexing and slicing are O(1) and O(k) respectively
+    and removing many items costs one pass over the array.
     '''
+    # one is created per parametrized function so keep instances small
+    __slots__ = ('_slots', '_keys', '_pos', 'name', 'parent')
+
     def __init__(self, funcitems=None):
-        self.funcs = OrderedDict()
+        self._slots = []  # items in insertion order or ``None`` if removed
+        self._keys = []  # key of each slot
+        self._pos = {}  # key -> position in ``_slots``
         if funcitems:
             if not isinstance(funcitems, list):
                 funcitems = [funcitems]
@@ -181,81 +752,335 @@ class FuncCollection(object):
                 self.append(item)
 
     def append(self, item, attr_path='nodeid'):
-        # self.funcs[tosymbol(attrgetter(attr_path)(item))] = item
-        self.funcs[attrgetter(attr_path)(item)] = item
+        # key = tosymbol(attrgetter(attr_path)(item))
+        key = attrgetter(attr_path)(item)
+        pos = self._pos.get(key)
+        if pos is None:
+            self._pos[key] = len(self._slots)
+            self._slots.append(item)
+            self._keys.append(key)
+        else:  # replace in place retaining the original order
+            self._slots[pos] = item
 
     def addtests(self, test_set):
         for item in test_set._items:
             self.append(item)
 
     def remove(self, item):
-        self.funcs.pop(item.nodeid, None)
+        self._discard(item.nodeid)
+
+    def _discard(self, key):
+        pos = self._pos.pop(key, None)
+        if pos is not None:
+            self._slots[pos] = None
 
     def removetests(self, test_set):
         for item in test_set._items:
-            self.remove(item)
+            self._discard(item.nodeid)
+
+    def removeitems(self, items):
+        '''Remove many items in a single batch
+        '''
+        for item in items:
+            self._discard(item.nodeid)
+
+    def removematching(self, pattern):
+        '''Remove all items who's key matches the regex ``pattern`` and
+        return the number removed
+        '''
+        search = re.compile(pattern).search
+        keys = [key for key in self._pos if search(key)]
+        for key in keys:
+            self._discard(key)
+        return len(keys)
+
+    def _compact(self):
+        '''Drop any tombstones left by removals
+        '''
+        if len(self._slots) == len(self._pos):
+            return
+        slots, keys = self._slots, self._keys
+        live = [i for i, item in enumerate(slots) if item is not None]
+        self._slots = [slots[i] for i in live]
+        self._keys = [keys[i] for i in live]
+        self._pos = dict((key, i) for i, key in enumerate(self._keys))
 
     def clear(self):
-        self.funcs.clear()
+        self._slots, self._keys, self._pos = [], [], {}
 
     def keys(self):
-        return self.funcs.keys()
+        self._compact()
+        return list(self._keys)
 
     def values(self):
-        return self.funcs.values()
+        self._compact()
+        return list(self._slots)
 
     def __len__(self):
-        return len(self.funcs)
+        return len(self._pos)
+
+    def __contains__(self, key):
+        return key in self._pos
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            return self.enumitems()[key][1]
         if isinstance(key, (int, slice)):
-            return list(map(itemgetter(1), self.enumitems()[key]))
-        return self.funcs[key]
+            self._compact()
+            return self._slots[key]
+        return self._slots[self._pos[key]]
 
     def __dir__(self):
         return dirinfo(self)
 
     def items(self):
-        return self.funcs.items()
+        self._compact()
+        return list(zip(self._keys, self._slots))
 
     def enumitems(self, items=None):
         if not items:
-            items = self.funcs.values()
+            items = self.values()
         return [(i, node) for i, node in enumerate(items)]
 
 
 class TestTree(object):
     '''A tree of all collected tests
     '''
-    def __init__(self, funcitems, termrep, shell, selection, config):
+    # max number of interned ``TestSet`` views
+    cache_size = 1024
+    # max number of list entries (mostly items) memoized by interned views
+    cache_weight = 1 << 20
+    # max number of tests shown when printing a test set
+    page_size = 100
+
+    def __init__(self, funcitems, termrep, shell, selection, config,
+                 lazy=False, root_name=None):
         self._funcitems = funcitems  # never modify this
         self._selection = selection  # items must be unique
-        self._path2items = OrderedDict()
-        self._item2paths = {}
+        self._lazy = lazy
+        self._version = 0  # bumped whenever new items are indexed
+        self._incoming = deque()  # items collected but not yet indexed
+        self._collecting = False
+        # each item is identified by its index in ``funcitems`` and each
+        # path's membership is stored as a compact bitset of those ids
+        self._path2mask = {}
         self._path2children = {}
+        self._path2keys = {}  # sorted child keys used for completion
+        # item id -> full path of that item (or of its parent collector
+        # until indexed when lazy)
+        self._leafpaths = [None] * len(funcitems)
+        # callspec id -> ids of items using it (a ``Bitset`` or, if
+        # sparse, ``SortedIds``)
+        self._param2ids = {}
+        self._symbols = {}  # memo of ``tosymbol`` results
+        self._pending = OrderedDict()  # collector path -> unindexed item ids
         self._nodes = {}
-        self._cache = {}
-        root_name = funcitems[0].listchain()[0].name if funcitems else ''
-        for item in funcitems:
-            for path, node in gen_nodes(item, self._nodes, root_name):
-                self._path2items.setdefault(path, []).append(item)
-                self._item2paths.setdefault(item, []).append(path)
-                if path not in self._nodes:
-                    self._nodes[path] = node
-                    # map parent path to set of children paths
-                    self._path2children.setdefault(path[:-1], []).append(path)
-        self._root = TestSet(self, (root_name,))
+        self._collectors = {}  # collector -> its and its ancestors' entries
+        self._cache = LRUCache(self.cache_size, self.cache_weight,
+                               evict=_forget)
+        # estimated duration of each item id and the per path totals
+        self._durations = None
+        self._durations_key = None
+        self._path2duration = {}
+        self._trigrams = None  # node id search index built on first use
+        self._nodeid2id = None
+        self._nodeid2id_version = None
+        if root_name is None:
+            root_name = funcitems[0].listchain()[0].name if funcitems else ''
+        self._root_name = root_name
+        if lazy:
+            self._index_collectors(range(len(funcitems)))
+        else:
+            self._index(range(len(funcitems)), self._gennodes)
+        self._root = self._testset((root_name,))
         self.__class__.__getitem__ = self._root.__getitem__
         # pytest terminal reporter
         self._tr = termrep
         self._shell = shell
         self._config = config
 
-    def from_items(self, items):
-        return type(self)(items, self._tr, self._shell, self._selection,
-                          self._config)
+    def _subset(self, nodeids):
+        """Return a view of the root restricted to the tests with the
+        provided node ids which shares this tree's index
+        """
+        return self._testset(self._root._path, members=Members(nodeids))
+
+    def extend(self, items):
+        """Queue newly collected items to be added to the tree. This is safe
+        to call from a thread other then the one running the shell; items
+        are indexed the next time the tree is accessed.
+        """
+        self._incoming.append(items)
+
+    def _refresh(self):
+        """Index any items queued by ``extend``
+        """
+        if not self._incoming:
+            return
+        start = len(self._funcitems)
+        while self._incoming:
+            self._funcitems.extend(self._incoming.popleft())
+        itemids = range(start, len(self._funcitems))
+        self._leafpaths.extend([None] * len(itemids))
+        if self._lazy:
+            self._index_collectors(itemids)
+        else:
+            self._index(itemids, self._gennodes)
+        # invalidate all views
+        self._version += 1
+        self._cache.clear()
+        self._cache[(self._root._path, (), None, None)] = self._root
+
+    def _gennodes(self, itemid, item):
+        return gen_nodes(
+            item, self._nodes, self._root_name, self._collectors)
+
+    def _add_path(self, path, node):
+        self._nodes[path] = node
+        # map parent path to set of children paths
+        self._path2children.setdefault(path[:-1], []).append(path)
+
+    def _idents(self, item):
+        '''Return the callspec ids of ``item`` as valid identifiers
+        '''
+        cs = getattr(item, 'callspec', None)
+        if not cs:
+            return ()
+        symbols = self._symbols
+        idents = []
+        for ident in cs.id.split('-'):
+            try:
+                ident = symbols[ident]
+            except KeyError:
+                ident = symbols[ident] = tosymbol(ident)
+            if ident:
+                idents.append(ident)
+        return idents
+
+    def _index_params(self, itemid, item, param2ids):
+        for ident in self._idents(item):
+            ids = param2ids.setdefault(ident, array('I'))
+            # an ident may be repeated in a single callspec id
+            if not ids or ids[-1] != itemid:
+                ids.append(itemid)
+
+    def _index(self, itemids, gennodes):
+        """Index the items with the provided ids using ``gennodes`` to
+        generate the ``(path, node)`` pairs of each item
+        """
+        funcitems = self._funcitems
+        path2ids = OrderedDict()
+        param2ids = {}
+        for itemid in itemids:
+            item = funcitems[itemid]
+            self._index_params(itemid, item, param2ids)
+            for path, node in gennodes(itemid, item):
+                ids = path2ids.get(path)
+                if ids is None:
+                    ids = path2ids[path] = array('I')
+                    if path not in self._nodes:
+                        self._add_path(path, node)
+                ids.append(itemid)
+            self._leafpaths[itemid] = path
+        self._merge(self._path2mask, path2ids)
+        self._merge_params(param2ids)
+        for path in set(path[:-1] for path in path2ids):
+            self._path2keys[path] = sorted(
+                child[-1] for child in self._path2children[path])
+
+    @staticmethod
+    def _merge(masks, key2ids):
+        for key, ids in key2ids.items():
+            mask = Bitset.from_ids(ids)
+            if key in masks:
+                mask |= masks[key]
+            masks[key] = mask
+
+    def _merge_params(self, param2ids):
+        postings = self._param2ids
+        for ident, ids in param2ids.items():
+            posting = postings.get(ident)
+            if posting is not None:
+                old = array('I', posting)
+                if old[-1] < ids[0]:  # items are mostly indexed in order
+                    ids = old + ids
+                else:
+                    ids = array('I', sorted(set(old).union(ids)))
+            postings[ident] = compact(ids)
+
+    def _index_collectors(self, itemids):
+        """Index only the collector hierarchy (packages, modules, classes)
+        deferring indexing of the items beneath each collector until it is
+        first navigated into.
+        """
+        funcitems = self._funcitems
+        groups = OrderedDict()
+        for itemid in itemids:
+            groups.setdefault(
+                funcitems[itemid].parent, array('I')).append(itemid)
+        path2ids = OrderedDict()
+        for collector, ids in groups.items():
+            for path, node in gen_nodes(collector, self._nodes,
+                                        self._root_name, self._collectors):
+                if path not in path2ids:
+                    path2ids[path] = array('I')
+                    if path not in self._nodes:
+                        self._add_path(path, node)
+                path2ids[path].extend(ids)
+            self._pending.setdefault(path, array('I')).extend(ids)
+            for itemid in ids:
+                self._leafpaths[itemid] = path
+        self._merge(self._path2mask, path2ids)
+        for path in set(path[:-1] for path in path2ids):
+            self._path2keys[path] = sorted(
+                child[-1] for child in self._path2children[path])
+
+    def _materialize(self, path, subtree=False):
+        """Index any pending items under the collector at ``path`` (or
+        anywhere beneath it if ``subtree`` is set)
+        """
+        if not self._pending:
+            return
+        if subtree:
+            depth = len(path)
+            paths = [p for p in self._pending if p[:depth] == path]
+        elif path in self._pending:
+            paths = [path]
+        else:
+            return
+        ids = array('I')
+        for cpath in paths:
+            ids.extend(self._pending.pop(cpath))
+        leafpaths = self._leafpaths
+        self._index(
+            sorted(ids),
+            lambda itemid, item: gen_item_nodes(
+                item, leafpaths[itemid], self._nodes))
+
+    def _search_index(self):
+        '''Return the trigram index of all item node ids
+        '''
+        from .search import TrigramIndex
+        self._refresh()
+        if self._trigrams is None:
+            self._trigrams = TrigramIndex()
+        indexed = len(self._trigrams)
+        if indexed < len(self._funcitems):
+            self._trigrams.extend(
+                item.nodeid for item in self._funcitems[indexed:])
+        return self._trigrams
+
+    def _testset(self, path, indices=None, params=(), members=None):
+        """Return the interned ``TestSet`` view for the provided path,
+        params, indices and members creating it if not yet cached
+        """
+        self._refresh()
+        key = (path, params, _indkey(indices), members)
+        testset = self._cache.get(key)
+        if testset is None:
+            self._materialize(path, subtree=bool(params))
+            testset = TestSet(self, path, indices, params, members)
+            testset._key = key
+            self._cache[key] = testset
+        return testset
 
     def __getattr__(self, key):
         try:
@@ -263,37 +1088,81 @@ class TestTree(object):
         except AttributeError:
             return getattr(self._root, key)
 
-    def _tprint(self, items, tr=None):
-        '''extended from
-        pytest.terminal.TerminalReporter._printcollecteditems
+    def _item_durations(self):
+        '''Estimated duration of each item id, rebuilt whenever items are
+        indexed or new durations have been recorded
+        '''
+        index = get_index(self._config)
+        if index is None:
+            return None
+        self._refresh()
+        key = (self._version, index.version)
+        if self._durations_key != key:
+            stats = index.stats
+            mean = index.mean()
+            self._durations = array('d', (
+                stats[item.nodeid][0] if item.nodeid in stats else mean
+                for item in self._funcitems))
+            self._durations_key = key
+            self._path2duration.clear()
+        return self._durations
+
+    def _duration(self, testset):
+        '''Estimated run time of ``testset`` or ``None`` if unknown
+        '''
+        durations = self._item_durations()
+        if durations is None:
+            return None
+        if testset._filtered:
+            return sum(durations[i] for i in testset._ids())
+        path = testset._path
+        total = self._path2duration.get(path)
+        if total is None:
+            total = self._path2duration[path] = sum(
+                durations[i] for i in testset._ids())
+        return total
+
+    def _estimate(self, items):
+        '''Estimated run time of ``items`` or ``None`` if unknown
+        '''
+        index = get_index(self._config)
+        if index is None:
+            return None
+        return index.estimate(item.nodeid for item in items)
+
+    def _itemids(self, items):
+        '''Map items (e.g. from the selection) to their ids in this tree
+        '''
+        return self._nodeids2ids(item.nodeid for item in items)
+
+    def _nodeids2ids(self, nodeids):
+        '''Map node ids to item ids skipping any not found in this tree
+        '''
+        self._refresh()
+        if self._nodeid2id_version != self._version:
+            self._nodeid2id = dict(
+                (item.nodeid, i) for i, item in enumerate(self._funcitems))
+            self._nodeid2id_version = self._version
+        nodeid2id = self._nodeid2id
+        return [nodeid2id[nodeid] for nodeid in nodeids
+                if nodeid in nodeid2id]
+
+    def _tprint(self, items, tr=None, start=0, limit=None, depth=None,
+                itemids=None):
+        '''Render ``items`` (or the items with the provided ids) as an
+        indented hierarchy showing at most ``limit`` items from ``start``
         '''
+        from .render import TreeRenderer
         if not tr:
             tr = self._tr
-        if not items:
+        if itemids is None:
+            itemids = self._itemids(items)
+        if not itemids:
             tr.write('ERROR: ', red=True)
             tr.write_line("not enough items to display")
             return
-        stack = []
-        indent = ""
-        ncols = int(math.ceil(math.log10(len(items))))
-        for i, item in enumerate(items):
-            needed_collectors = item.listchain()[1:]  # strip root node
-            while stack:
-                if stack == needed_collectors[:len(stack)]:
-                    break
-                stack.pop()
-            for col in needed_collectors[len(stack):]:
-                if col.name == "()":
-                    continue
-                stack.append(col)
-                indent = (len(stack) - 1) * "  "
-                if col == item:
-                    index = "{}".format(i)
-                else:
-                    index = ''
-                indent = indent[:-len(index) or None] + (ncols+1) * " "
-                tr.write("{}".format(index), green=True)
-                tr.write_line("{}{}".format(indent, col))
+        TreeRenderer(self, limit=limit, depth=depth).write(
+            tr, itemids, start=start)
 
     def err(self, msg):
         self._tr.write("ERROR: ", red=True)
@@ -320,13 +1189,7 @@ class TestTree(object):
                 "No cache entry for '{}'"
                 .format('{}[key={}]'.format(path, key)))
 
-        items_dict = OrderedDict(
-            [(item.nodeid, item) for item in self._funcitems])
-
-        return self.from_items(
-            [items_dict.get(name) for name in testnames
-             if items_dict.get(name)]
-        )._root
+        return self._subset(testnames)
 
     def set_cache_items(self, key, testset):
         """Enter test items for the given name into the cache under
@@ -346,23 +1209,63 @@ class TestTree(object):
         cache.set("pytest-interactive/cache", cachedict)
 
 
-def item2params(item):
-    cs = getattr(item, 'callspec', None)
-    # return map(tosymbol, cs.params.values())
-    return tuple(map(tosymbol, cs.id.split('-'))) if cs else ()
+class CallspecParameters(object):
+    """Namespace of the callspec ids available in a `TestSet` where each
+    attribute delivers a new `TestSet` filtered by that id
+    """
+    __slots__ = ('_testset', '_idents', '_identset')
 
+    def __init__(self, testset, idents):
+        self._testset = testset
+        self._idents = idents  # sorted
+        self._identset = frozenset(idents)
 
-def by_name(idents):
-    if idents:
-        def predicate(item):
-            params = item2params(item)
-            for ident in idents:
-                if ident not in params:
-                    return False
-            return True
-        return predicate
-    else:
-        return lambda item: True
+    def __dir__(self):
+        return list(self._idents)
+
+    def __contains__(self, ident):
+        return ident in self._identset
+
+    def _complete(self, prefix):
+        return _prefixed(self._idents, prefix)
+
+    def __getattr__(self, ident):
+        if ident not in self._identset:
+            raise AttributeError(ident)
+        testset = self._testset
+        return testset._new(params=testset._params + (ident,))
+
+
+class Members(object):
+    '''The members of a set derived from the tree as a ``Bitset`` of item
+    ids. Either a fixed mask (such as the result of set operations) or the
+    node ids of a cached test set which are resolved to a mask whenever new
+    items are indexed so that streamed tests are included once collected.
+    Instances hash by identity to key interned views.
+    '''
+    def __init__(self, nodeids=None, mask=None):
+        self.nodeids = list(nodeids) if nodeids is not None else None
+        self._mask = mask
+        self._order = None
+        self._version = None
+
+    def mask(self, tree):
+        if self.nodeids is not None and self._version != tree._version:
+            seen = set()
+            self._order = [i for i in tree._nodeids2ids(self.nodeids)
+                           if not (i in seen or seen.add(i))]
+            self._mask = Bitset.from_ids(self._order)
+            self._version = tree._version
+        return self._mask
+
+    def order(self, tree):
+        '''Return the item ids of a cached set in the order they were saved
+        or ``None`` if the members are ordered as the tree
+        '''
+        if self.nodeids is None:
+            return None
+        self.mask(tree)
+        return self._order
 
 
 class TestSet(object):
@@ -370,7 +1273,11 @@ class TestSet(object):
     object in ipython. An internal reference is kept to the pertaining pytest
     Node and hierarchical lookups are delegated to the containing TestTree.
     '''
-    def __init__(self, tree, path, indices=None, params=()):
+    # a new set is created for most lookups made in the shell
+    __slots__ = ('_tree', '_path', '_len', '_ind', '_params', '_members',
+                 '_memo', '_key')
+
+    def __init__(self, tree, path, indices=None, params=(), members=None):
         self._tree = tree
         self._path = path
         self._len = len(path)
@@ -382,7 +1289,9 @@ class TestSet(object):
             indices = slice(indices, indices + 1 or None)
         self._ind = indices  # might be a slice
         self._params = params
-        self._paramf = by_name(params)
+        self._members = members  # restricts a derived set (e.g. lastfailed)
+        self._memo = {}
+        self._key = None  # set once interned by the tree
 
     def __str__(self):
         return "<{} with {} items>".format(
@@ -391,66 +1300,157 @@ class TestSet(object):
     def __repr__(self):
         """Pretty print the current set to console
         """
-        self._tree._tr.write_line("")
-        items = self._items
-        self._tree._tprint(items)
-        self._tree._tr.write_line("")
+        tree = self._tree
+        tree._tr.write_line("")
+        itemids = list(self._ids())
+        tree._tprint(None, limit=tree.page_size, itemids=itemids)
+        tree._tr.write_line("")
         # nodename = getattr(self._node, 'name', None)
         # TODO: it'd be nice if we could render the std pytest cli selection
         # syntax here for copy paste to a direct shell invocation.
-        ident = "Total {} tests".format(len(items))
+        ident = "Total {} tests".format(len(itemids))
+        duration = self._tree._duration(self)
+        if duration is not None:
+            ident += " (~{})".format(format_duration(duration))
         return ident
 
     def __dir__(self):
         if isinstance(self._node, FuncCollection):
             return dir(self.params)
-        return self._childkeys + ['params']
+        return self._childkeys + ['find', 'params']
+
+    def _complete(self, prefix, keys=False):
+        '''Return the sorted child keys (or callspec ids when this is a
+        parametrized function) starting with ``prefix``. Candidates are
+        found by bisecting the tree's sorted key arrays and (only if this
+        set is filtered) checked against this set's mask. String ``keys``
+        lookups complete child keys and callspec ids but no attributes.
+        '''
+        tree = self._tree
+        if isinstance(self._node, FuncCollection):
+            return self._complete_params(prefix)
+        names = _prefixed(tree._path2keys.get(self._path, []), prefix)
+        if self._filtered:
+            mask = self._mask
+            path2mask = tree._path2mask
+            names = [key for key in names
+                     if path2mask[self._path + (key,)].intersects(mask)]
+        if keys:
+            names += self._complete_params(prefix)
+        else:
+            names += _prefixed(['find', 'params'], prefix)
+        return sorted(set(names))
+
+    def _complete_params(self, prefix):
+        '''Return the sorted callspec ids in this set starting with
+        ``prefix``
+        '''
+        return self.params._complete(prefix)
 
     @property
+    @memoized
     def _childkeys(self):
         '''sorted list of child keys
         '''
-        return sorted([key[self._len] for key in self._iterchildren()])
+        keys = self._tree._path2keys.get(self._path, [])
+        if self._filtered:
+            # collect the child keys which contain at least one of our
+            # items in a single pass over our items' paths
+            leafpaths = self._tree._leafpaths
+            depth = self._len
+            present = set(
+                leafpaths[i][depth] for i in self._ids()
+                if len(leafpaths[i]) > depth)
+            keys = [key for key in keys if key in present]
+        return keys
 
     @property
+    @memoized
+    def _childkeyset(self):
+        return frozenset(self._childkeys)
+
+    @property
+    def _filtered(self):
+        '''True if this set is a strict subset of the items under its path
+        '''
+        return (bool(self._params) or self._ind != slice(None) or
+                self._members is not None)
+
+    @property
+    @memoized
     def params(self):
-        """Return a `CallSpecParameters` object who's instance variables are
+        """Return a `CallspecParameters` object who's instance variables are
         named according to available 'callspec parameters' in child nodes and
         who's values are `TestSets` corresponding to tests which contain those
         parameters
         """
-        def _new(ident):
-            """Closure who delivers a func who returns new `TestSets` based on
-            this one but with an extended `_params` according to `ident`
-            """
-            @property
-            def test_set(pself):
-                return self._new(params=self._params + (ident,))
-            return test_set
-
-        ns = {}
-        for item in self._items:
-            ns.update({ident: _new(ident) for ident in item2params(item)
-                      if ident and ident not in self._params})
-        return type('CallspecParameters', (), ns)()
+        tree = self._tree
+        tree._materialize(self._path, subtree=True)
+        mask = self._mask
+        postings = tree._param2ids
+        if len(mask) < len(postings):
+            # collect the callspec ids of the (fewer) tests in this set
+            items = tree._funcitems
+            found = set()
+            for i in mask:
+                found.update(tree._idents(items[i]))
+            found.difference_update(self._params)
+        else:
+            # sparse postings are bisected to the ids within the mask's span
+            found = [ident for ident, posting in postings.items()
+                     if ident not in self._params and posting.intersects(mask)]
+        return CallspecParameters(self, sorted(found))
 
     def _iterchildren(self):
         # if we have callspec ids in our getattr chain, filter out any
-        # children who's items are not in our set by checking the
-        # intersection of our items with child items
-        for path in self._tree._path2children[self._path]:
-            if set(self._tree._path2items[path]) & set(self._items):
+        # children who's items are not in our set
+        children = self._tree._path2children.get(self._path, ())
+        if not self._filtered:
+            for path in children:
+                yield path
+            return
+        keys = self._childkeyset
+        for path in children:
+            if path[-1] in keys:
                 yield path
 
     def __iter__(self):
         for path in self._iterchildren():
             yield self._new(path=path)
 
+    @memoized
+    def _ids(self):
+        '''Ordered item ids in this set; the path's ``Bitset`` is
+        returned as is when no filtering or slicing is required. Cached
+        sets are ordered as they were saved.
+        '''
+        ids = self._tree._path2mask.get(self._path, Bitset())
+        # intersect with the posting list of each callspec id
+        param2ids = self._tree._param2ids
+        for ident in self._params:
+            ids &= param2ids.get(ident, Bitset())
+        if self._members is not None:
+            ids &= self._members.mask(self._tree)
+            order = self._members.order(self._tree)
+            if order is not None:
+                ids = [i for i in order if i in ids]
+        if self._ind == slice(None):
+            return ids
+        return list(ids)[self._ind]
+
     @property
+    @memoized
+    def _mask(self):
+        ids = self._ids()
+        if isinstance(ids, Bitset):
+            return ids
+        return Bitset.from_ids(ids)
+
+    @property
+    @memoized
     def _items(self):
-        # XXX might it be possible here to do something more efficient here?
-        return [item for item in filter(self._paramf,
-                self._tree._path2items[self._path])][self._ind]
+        items = self._tree._funcitems
+        return [items[i] for i in self._ids()]
 
     def _enumitems(self):
         return self._tree._selection.enumitems(self._items)
@@ -461,22 +1461,62 @@ class TestSet(object):
         if isinstance(key, str):
             if key is 'parent':
                 return self._new(path=self._path[:-1])
-            elif key in self._childkeys:  # key is a subchild name
+            elif key in self._childkeyset:  # key is a subchild name
                 return self._new(path=self._path + (key,))
             else:
-                if key in dir(self.params):
+                if key in self.params:
                     return self._new(params=self._params + (key,))
                 raise KeyError(key)
         elif isinstance(key, (int, slice)):
             return self._new(indices=key)
 
+    def find(self, pattern, regex=False, glob=False):
+        """Return the tests in this set who's node id contains ``pattern``
+        or, if ``regex`` or ``glob`` is set, matches it as a regular
+        expression (anywhere in the node id) or glob (the whole node id)
+        """
+        matches = self._tree._search_index().search(
+            pattern, regex=regex, glob=glob)
+        return self._tree._testset(
+            self._path, members=Members(mask=self._mask & matches))
+
+    def _combine(self, other, op):
+        '''Return a view of the items resulting from applying the ``Bitset``
+        operator ``op`` to this and another set's masks
+        '''
+        if not isinstance(other, TestSet):
+            return NotImplemented
+        if other._tree is not self._tree:
+            raise TypeError("Can't combine test sets from different trees")
+        # root the view at the deepest path common to both sets
+        path = self._path
+        for i, (key, okey) in enumerate(zip(self._path, other._path)):
+            if key != okey:
+                path = self._path[:i]
+                break
+        else:
+            path = path[:len(other._path)]
+        return self._tree._testset(
+            path, members=Members(mask=op(self._mask, other._mask)))
+
+    def __or__(self, other):
+        return self._combine(other, or_)
+
+    def __and__(self, other):
+        return self._combine(other, and_)
+
+    def __sub__(self, other):
+        return self._combine(other, sub)
+
+    def __xor__(self, other):
+        return self._combine(other, xor)
+
     def _new(self, tree=None, path=None, indices=None, params=None):
-        # do caching?  return self._tree._cache.setdefault(args*, ...
-        return type(self)(
-            tree or self._tree,
+        return (tree or self._tree)._testset(
             path or self._path,
             indices,
-            params or self._params)
+            params or self._params,
+            self._members)
 
     def __getattr__(self, attr):
         try:
@@ -489,7 +1529,7 @@ class TestSet(object):
 
     @property
     def _node(self, path=None):
-        return self._tree._nodes[path or self._path]
+        return self._tree._nodes.get(path or self._path)
 
     def __call__(self, key=None):
         """Select and run all tests under this node
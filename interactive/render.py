@@ -0,0 +1,122 @@
+"""
+Render test sets as an indented collector hierarchy
+"""
+from .plugin import FuncCollection, Package
+
+
+class TreeRenderer(object):
+    """Render items of a ``TestTree`` (given by item id) in a single pass
+    over the tree's index writing all output as one buffer.
+
+    ``limit`` is the number of items shown per page after which a
+    summary of the remaining tests is written. Collectors deeper than
+    ``depth`` are not shown; instead the deepest shown collector is
+    followed by the number of tests beneath it.
+    """
+    def __init__(self, tree, limit=None, depth=None):
+        self.tree = tree
+        self.limit = limit
+        self.depth = depth
+        self._chains = {}  # parent path -> displayed ancestor paths
+
+    def _chain(self, path):
+        '''Paths of the collectors displayed above the items whose parent
+        is at ``path`` (the root and synthesized nodes are not shown)
+        '''
+        chain = self._chains.get(path)
+        if chain is None:
+            nodes = self.tree._nodes
+            chain = self._chains[path] = tuple(
+                path[:i] for i in range(2, len(path) + 1)
+                if not isinstance(nodes.get(path[:i]),
+                                  (FuncCollection, Package)))
+        return chain
+
+    def _parent(self, itemid):
+        tree = self.tree
+        path = tree._leafpaths[itemid]
+        # lazily indexed items only record the path of their collector
+        if tree._nodes.get(path) is tree._funcitems[itemid]:
+            return path[:-1]
+        return path
+
+    def fit(self, itemids, lines):
+        """Return the largest depth (or ``None`` for no limit) at which the
+        provided items can be rendered in at most ``lines`` lines
+        """
+        if len(itemids) <= lines:
+            return None
+        # count the displayed collectors at each depth in one pass
+        counts = []
+        last = ()
+        for itemid in itemids:
+            chain = self._chain(self._parent(itemid))
+            for level, path in enumerate(chain):
+                if level == len(counts):
+                    counts.append(0)
+                if level >= len(last) or last[level] != path:
+                    counts[level] += 1
+            last = chain
+        depth, total = 0, 0
+        for count in counts:
+            total += count
+            if total > lines:
+                break
+            depth += 1
+        return max(depth, 1)
+
+    def lines(self, itemids, start=0, markup=None):
+        """Render ``itemids[start:start + limit]`` returning a list of lines
+        where each item is prefixed with its position in ``itemids``.
+        ``markup`` is used to highlight the positions when provided.
+        """
+        tree = self.tree
+        nodes, items = tree._nodes, tree._funcitems
+        stop = len(itemids)
+        if self.limit is not None:
+            stop = min(stop, start + self.limit)
+        width = len(str(max(stop - 1, 0))) + 1
+        blank = ' ' * width
+        depth = self.depth
+        lines = []
+        counts = {}  # line number of a collapsed collector -> test count
+        stack = ()
+        for pos in range(start, stop):
+            itemid = itemids[pos]
+            chain = self._chain(self._parent(itemid))
+            collapsed = depth is not None and len(chain) >= depth
+            if collapsed:
+                chain = chain[:depth]
+            # skip the prefix of collectors which are already displayed
+            common = 0
+            for old, new in zip(stack, chain):
+                if old != new:
+                    break
+                common += 1
+            for level in range(common, len(chain)):
+                lines.append('{}{}{}'.format(
+                    blank, '  ' * level, nodes[chain[level]]))
+            stack = chain
+            if collapsed:
+                line = len(lines) - 1
+                counts[line] = counts.get(line, 0) + 1
+                continue
+            index = '{:<{}}'.format(pos, width)
+            if markup:
+                index = markup(index, green=True)
+            lines.append('{}{}{}'.format(
+                index, '  ' * len(chain), items[itemid]))
+        for line, count in counts.items():
+            lines[line] += ' ({} tests)'.format(count)
+        remaining = len(itemids) - stop
+        if remaining:
+            lines.append('... {} more tests'.format(remaining))
+        return lines
+
+    def write(self, tr, itemids, start=0):
+        """Write the rendered items to the terminal reporter ``tr``
+        """
+        tw = getattr(tr, '_tw', None)
+        markup = getattr(tw, 'markup', None) if tw else None
+        lines = self.lines(itemids, start=start, markup=markup)
+        tr.write('\n'.join(lines) + '\n')
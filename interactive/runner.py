@@ -0,0 +1,344 @@
+"""
+Run test selections from within the shell
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import queue
+import tempfile
+import threading
+import subprocess
+import contextlib
+import pytest
+from .worker import FD_ENV, NODEIDS_ENV
+from .durations import get_index
+
+
+class ResultsCollector(object):
+    """Plugin which records the outcome of each test run
+    """
+    def __init__(self):
+        self.outcomes = {}
+        self.durations = {}
+        self.duration = 0
+        self.errors = []  # output of any workers which failed
+
+    def pytest_runtest_logreport(self, report):
+        nodeid = report.nodeid
+        self.durations[nodeid] = (
+            self.durations.get(nodeid, 0) + getattr(report, 'duration', 0))
+        if report.failed:
+            outcome = 'failed' if report.when == 'call' else 'error'
+        elif report.skipped:
+            outcome = 'skipped'
+        elif report.when == 'call':
+            outcome = 'passed'
+        else:
+            return
+        # keep the first failure or error
+        if self.outcomes.get(nodeid) not in ('failed', 'error'):
+            self.outcomes[nodeid] = outcome
+
+    def summary(self):
+        counts = {}
+        for outcome in self.outcomes.values():
+            counts[outcome] = counts.get(outcome, 0) + 1
+        parts = ['{} {}'.format(counts[outcome], outcome)
+                 for outcome in ('failed', 'passed', 'skipped', 'error')
+                 if outcome in counts]
+        return "{} in {:.2f} seconds".format(
+            ', '.join(parts) or 'no tests ran', self.duration)
+
+
+# terminal reporter state updated by the reports of a run
+_REPORTER_STATE = ('stats', '_progress_nodeids_reported', '_numcollected',
+                   'currentfspath', '_tests_ran')
+
+
+@contextlib.contextmanager
+def _reporting(config):
+    """Keep the reports of a run from the shell out of the session's
+    terminal summary: the run's failures and errors are printed once it
+    completes and the terminal reporter's state is then restored
+    """
+    tr = config.pluginmanager.getplugin('terminalreporter')
+    if tr is None:
+        yield
+        return
+    saved = dict((name, getattr(tr, name)) for name in _REPORTER_STATE
+                 if hasattr(tr, name))
+    tr.stats = {}
+    tr._progress_nodeids_reported = set()
+    try:
+        yield
+        # pytest writes the final progress once its run loop completes
+        if (config.option.verbose <= 0 and tr._progress_nodeids_reported and
+                getattr(tr, '_show_progress_info', False)):
+            tr._write_progress_information_filling_space()
+        tr.summary_errors()
+        tr.summary_failures()
+    finally:
+        for name, value in saved.items():
+            setattr(tr, name, value)
+        if hasattr(tr, '_set_main_color'):
+            tr._set_main_color()
+
+
+@contextlib.contextmanager
+def _collecting(session, items):
+    """Register a ``ResultsCollector`` for the duration of a run of
+    ``items``
+    """
+    results = ResultsCollector()
+    config = session.config
+    config.pluginmanager.register(results)
+    # failures while in the shell must not be treated as collection errors
+    testsfailed = session.testsfailed
+    # the shell runs before the session's collection has finished so
+    # report the progress of the run relative to its own items
+    testscollected = session.testscollected
+    session.testscollected = len(items)
+    start = time.time()
+    try:
+        with _reporting(config):
+            yield results
+    finally:
+        config.pluginmanager.unregister(results)
+        # reset so that the session can still run after the shell exits
+        session.shouldfail = session.shouldstop = False
+        session.testsfailed = testsfailed
+        session.testscollected = testscollected
+        results.duration = time.time() - start
+
+
+def _check_collected(items):
+    for item in items:
+        if not isinstance(item, pytest.Item):
+            raise TypeError(
+                "'{}' has not been collected and cannot be run".format(
+                    item.nodeid))
+
+
+def runtests(session, items):
+    """Run ``items`` in process through the standard runtest protocol and
+    return a ``ResultsCollector`` once all tests have completed.
+
+    Fixtures are torn down after the last item such that the same
+    selection may be run again.
+    """
+    _check_collected(items)
+    hook = session.config.hook
+    with _collecting(session, items) as results:
+        for i, item in enumerate(items):
+            nextitem = items[i + 1] if i + 1 < len(items) else None
+            # drop output sections captured by any previous run
+            item._report_sections = []
+            hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+            if session.shouldfail or session.shouldstop:
+                break
+    return results
+
+
+def partition(nodeids, durations, n):
+    """Split ``nodeids`` into ``n`` buckets of roughly equal total
+    duration by greedily assigning the longest tests first to the least
+    loaded bucket. Tests without a recorded duration are assumed to take
+    the mean of all known durations. Collection order is retained within
+    each bucket.
+    """
+    known = [durations[nodeid] for nodeid in nodeids if nodeid in durations]
+    default = sum(known) / len(known) if known else 1.
+    order = dict((nodeid, i) for i, nodeid in enumerate(nodeids))
+    weighted = sorted(
+        nodeids, key=lambda nodeid: durations.get(nodeid, default),
+        reverse=True)
+    heap = [(0., i) for i in range(n)]
+    buckets = [[] for _ in range(n)]
+    for nodeid in weighted:
+        load, i = heapq.heappop(heap)
+        buckets[i].append(nodeid)
+        heapq.heappush(heap, (load + durations.get(nodeid, default), i))
+    return [sorted(bucket, key=order.get) for bucket in buckets if bucket]
+
+
+# destinations of options which select tests, write session wide output,
+# need a terminal or don't run tests and so are not passed to workers
+_WORKER_EXCLUDED = frozenset((
+    'keyword', 'markexpr', 'lf', 'failedfirst', 'newfirst',
+    'last_failed_no_failures', 'stepwise', 'stepwise_skip', 'xmlpath',
+    'usepdb', 'trace', 'collectonly', 'cacheclear', 'basetemp', 'rootdir',
+    'showfixtures', 'show_fixtures_per_test', 'markers', 'version', 'help',
+    'setuponly', 'setupplan', 'debug', 'pastebin', 'numprocesses',
+))
+
+
+def _excluded(action):
+    dest = action.dest
+    return (dest in _WORKER_EXCLUDED or dest == 'interactive' or
+            dest.startswith('ia_'))
+
+
+def _nvalues(action, args):
+    """Number of the leading ``args`` consumed as the values of ``action``
+    """
+    nargs = action.nargs
+    if nargs is None:
+        return 1
+    if isinstance(nargs, int):
+        return nargs
+    n = 0
+    while n < len(args) and not args[n].startswith('-'):
+        n += 1
+        if nargs == '?':
+            break
+    return n
+
+
+def worker_args(config):
+    """Return the options of the session's command line which apply to
+    worker processes: all but the file or directory arguments, those of
+    this plugin and those listed in ``_WORKER_EXCLUDED``
+    """
+    parser = config._parser
+    optparser = getattr(parser, 'optparser', None)
+    if optparser is None:  # pytest < 9
+        optparser = parser._getparser()
+    actions = optparser._option_string_actions
+    args = [str(arg) for arg in config.invocation_params.args]
+    forwarded = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        i += 1
+        if arg == '--':
+            break  # only files and directories follow
+        if not arg.startswith('-') or arg == '-':
+            continue  # a file or directory
+        name, eq, _ = arg.partition('=')
+        if name in actions:
+            flags = [actions[name]]
+            attached = bool(eq)
+        elif not arg.startswith('--') and arg[:2] in actions:
+            # grouped short flags (``-vx``) where the last may take a
+            # value, attached (``-Werror``) or as the next argument
+            flags = []
+            for j in range(1, len(arg)):
+                flag = actions.get('-' + arg[j])
+                if flag is None:
+                    break
+                flags.append(flag)
+                if flag.nargs != 0:
+                    break
+            attached = j + 1 < len(arg)
+        else:  # unknown to argparse, pass it on
+            forwarded.append(arg)
+            continue
+        last = flags[-1]
+        n = 0 if attached or last.nargs == 0 else _nvalues(last, args[i:])
+        if not any(_excluded(flag) for flag in flags):
+            forwarded.extend(args[i - 1:i + n])
+        i += n
+    return forwarded
+
+
+class Worker(object):
+    """A ``pytest`` subprocess running a bucket of tests
+    """
+    def __init__(self, config, nodeids, events):
+        self.nodeids = nodeids
+        fd, self._nodeids_path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(nodeids))
+        rootdir = str(getattr(config, 'rootpath', None) or config.rootdir)
+        # only collect the files containing the assigned tests
+        files = []
+        for nodeid in nodeids:
+            path = os.path.join(rootdir, nodeid.split('::', 1)[0])
+            if path not in files:
+                files.append(path)
+        read, write = os.pipe()
+        env = dict(os.environ)
+        env[FD_ENV] = str(write)
+        env[NODEIDS_ENV] = self._nodeids_path
+        self._output = tempfile.TemporaryFile()
+        # results are recorded by this process so workers don't write the
+        # last failed tests or durations to the cache
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'pytest', '-p', 'interactive.worker',
+             '-p', 'no:lfplugin', '-p', 'no:interactive-durations',
+             '--rootdir', rootdir] + worker_args(config) + files,
+            env=env, pass_fds=(write,), stdout=self._output,
+            stderr=subprocess.STDOUT)
+        os.close(write)
+        self._reader = threading.Thread(
+            target=self._read, args=(os.fdopen(read), events))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read(self, stream, events):
+        with stream:
+            for line in stream:
+                events.put((self, json.loads(line)))
+        events.put((self, None))
+
+    def finish(self):
+        """Wait for the process to exit and return any output it wrote if
+        it failed to run its tests
+        """
+        returncode = self.proc.wait()
+        os.remove(self._nodeids_path)
+        self._output.seek(0)
+        output = self._output.read().decode('utf-8', 'replace')
+        self._output.close()
+        # 0 and 1 are "all passed" and "some failed" respectively
+        return output if returncode not in (0, 1) else None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+
+def runtests_parallel(session, items, n):
+    """Run ``items`` distributed over ``n`` local worker processes,
+    balanced by historical test durations. Reports are relayed to this
+    process's hooks as they arrive and a ``ResultsCollector`` is returned.
+    """
+    _check_collected(items)
+    config = session.config
+    hook = config.hook
+    buckets = partition(
+        [item.nodeid for item in items], get_index(config).durations(), n)
+    events = queue.Queue()
+    workers = []
+    with _collecting(session, items) as results:
+        try:
+            for nodeids in buckets:
+                workers.append(Worker(config, nodeids, events))
+            running = len(workers)
+            while running:
+                worker, event = events.get()
+                if event is None:
+                    running -= 1
+                    output = worker.finish()
+                    if output:
+                        results.errors.append(output)
+                    continue
+                kind = event['event']
+                if kind == 'report':
+                    hook.pytest_runtest_logreport(
+                        report=hook.pytest_report_from_serializable(
+                            config=config, data=event['data']))
+                elif kind == 'logstart':
+                    hook.pytest_runtest_logstart(
+                        nodeid=event['nodeid'],
+                        location=tuple(event['location']))
+                elif kind == 'logfinish':
+                    hook.pytest_runtest_logfinish(
+                        nodeid=event['nodeid'],
+                        location=tuple(event['location']))
+        finally:
+            for worker in workers:
+                worker.kill()
+    return results
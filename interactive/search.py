@@ -0,0 +1,172 @@
+"""
+Trigram index over test node ids for fast substring, regex and glob search
+"""
+import re
+import fnmatch
+from array import array
+from .bitset import Bitset
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # < py3.11
+    import sre_parse
+
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _regex_literals(pattern):
+    '''Return the literal substrings any match of ``pattern`` must contain
+    (only runs of literals at the top level of the pattern are considered)
+    '''
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return []
+    literals, run = [], []
+    for op, arg in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(arg))
+            continue
+        if run:
+            literals.append(''.join(run))
+        run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def _glob_literals(pattern):
+    return re.split(r'\*|\?|\[[^\]]*\]', pattern)
+
+
+def _split(nodeid):
+    '''Split a node id into its collector, function and parameter parts
+    '''
+    prefix, sep, name = nodeid.rpartition('::')
+    func, bracket, params = name.partition('[')
+    return prefix, sep + func, bracket + params
+
+
+class TrigramIndex(object):
+    """Map each trigram to the ids of the items who's node id contains it.
+
+    Node ids are split into their collector (file path and classes),
+    function and parameter parts (each part prefixed by the two characters
+    preceding it such that trigrams spanning a boundary are kept). Since
+    most parts are shared by many items only the trigrams of each distinct
+    part are indexed along with the items containing that part. Queries
+    intersect the items of the rarest trigrams of the literals the pattern
+    requires and only verify the remaining candidates.
+    """
+    # stop intersecting once this few candidates remain
+    min_candidates = 64
+
+    def __init__(self):
+        self._nodeids = []
+        self._parts = {}  # part text -> part id
+        self._part2ids = []  # part id -> ids of items containing the part
+        self._postings = {}  # trigram -> ids of parts containing it
+        self._counts = {}  # memo of item counts per trigram
+
+    def __len__(self):
+        return len(self._nodeids)
+
+    def _add_part(self, text, itemid):
+        partid = self._parts.get(text)
+        if partid is None:
+            partid = self._parts[text] = len(self._part2ids)
+            self._part2ids.append(array('I'))
+            postings = self._postings
+            for trigram in _trigrams(text):
+                posting = postings.get(trigram)
+                if posting is None:
+                    posting = postings[trigram] = array('I')
+                posting.append(partid)
+        self._part2ids[partid].append(itemid)
+
+    def extend(self, nodeids):
+        """Index the node ids of newly added items (in item id order)
+        """
+        start = len(self._nodeids)
+        nodeids = list(nodeids)
+        self._nodeids.extend(nodeids)
+        self._counts.clear()
+        add = self._add_part
+        for itemid, nodeid in enumerate(nodeids, start):
+            prefix, func, params = _split(nodeid)
+            add(prefix, itemid)
+            add(prefix[-2:] + func, itemid)
+            if params:
+                add(func[-2:] + params, itemid)
+
+    def _count(self, trigram):
+        '''Number of items (possibly with repeats) containing ``trigram``
+        '''
+        count = self._counts.get(trigram)
+        if count is None:
+            part2ids = self._part2ids
+            count = self._counts[trigram] = sum(
+                len(part2ids[partid])
+                for partid in self._postings.get(trigram, ()))
+        return count
+
+    def _ids(self, trigram):
+        part2ids = self._part2ids
+        ids = set()
+        for partid in self._postings.get(trigram, ()):
+            ids.update(part2ids[partid])
+        return ids
+
+    def candidates(self, literals):
+        """Return the set of ids of items containing the trigrams of
+        ``literals`` or ``None`` if no trigrams are available. Intersection
+        stops early once verifying the candidates is cheaper than expanding
+        the parts of the next trigram so the result may be a superset.
+        """
+        trigrams = set()
+        for literal in literals:
+            trigrams.update(_trigrams(literal))
+        if not trigrams:
+            return None
+        # order by the number of distinct parts containing each trigram
+        postings = self._postings
+        ordered = sorted(
+            trigrams, key=lambda trigram: len(postings.get(trigram, ())))
+        ids = None
+        for trigram in ordered:
+            if ids is not None:
+                if (len(ids) <= self.min_candidates or
+                        len(postings.get(trigram, ())) > len(ids)):
+                    break
+                # skip trigrams found in many more items than candidates
+                if self._count(trigram) > 4 * len(ids):
+                    continue
+            found = self._ids(trigram)
+            ids = found if ids is None else ids & found
+        return ids
+
+    def search(self, pattern, regex=False, glob=False):
+        """Return a ``Bitset`` of the ids of items who's node id contains
+        ``pattern`` as a substring, matches it as a regular expression
+        (``re.search``) or as a glob against the whole node id
+        """
+        if regex:
+            match = re.compile(pattern).search
+            literals = _regex_literals(pattern)
+        elif glob:
+            match = re.compile(fnmatch.translate(pattern)).match
+            literals = _glob_literals(pattern)
+        else:
+            def match(nodeid):
+                return pattern in nodeid
+            literals = [pattern]
+        ids = self.candidates(literals)
+        if ids is None:
+            ids = range(len(self._nodeids))
+        nodeids = self._nodeids
+        return Bitset.from_ids(i for i in ids if match(nodeids[i]))
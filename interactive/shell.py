@@ -1,12 +1,65 @@
 """
 An extended shell for test selection
 """
-import keyword 
-import re
+import sqlite3
+import threading
 from IPython.terminal.embed import InteractiveShellEmbed
 from IPython.core.magic import (Magics, magics_class, line_magic)
 from IPython.core.history import HistoryManager
 from IPython.terminal.prompts import Prompts, Token
+from .commands import (SelectionCommands, TreeCompleter, prompt_parts,
+                       exit_message)
+from .timing import phase
+
+try:
+    from IPython.core.completer import SimpleCompletion
+except ImportError:  # IPython < 8.6
+    SimpleCompletion = None
+
+
+def _matcher(completer):
+    """Adapt ``completer`` to IPython's (>= 8.6) matcher API suppressing all
+    other matchers (including jedi) when completing a test set lookup; any
+    other text is left to IPython's own matchers
+    """
+    def matcher(context):
+        result = completer.complete(context.text_until_cursor)
+        if result is None:
+            return {'completions': []}
+        fragment, keys = result
+        return {
+            'completions': [SimpleCompletion(key) for key in keys],
+            'matched_fragment': fragment,
+            'suppress': True,
+            'ordered': True,
+        }
+    matcher.matcher_api_version = 2
+    matcher.matcher_priority = 1  # ahead of IPython's own matchers
+    return matcher
+
+
+def _legacy_matcher(completer):
+    """Adapt ``completer`` to the matcher API of IPython < 8.6 which
+    receives the current token and returns full completions of it
+    """
+    def matcher(text):
+        line = completer.shell.Completer.text_until_cursor
+        result = completer.complete(line)
+        if result is None:
+            return []
+        fragment, keys = result
+        base = text[:len(text) - len(fragment)]
+        return [base + key for key in keys]
+    return matcher
+
+
+def register_completer(shell):
+    completer = TreeCompleter(shell)
+    if SimpleCompletion is None:
+        shell.Completer.custom_matchers.append(_legacy_matcher(completer))
+    else:
+        shell.Completer.custom_matchers.append(_matcher(completer))
+    return completer
 
 
 class TestCounterPrompt(Prompts):
@@ -14,11 +67,69 @@ class TestCounterPrompt(Prompts):
         """Render a simple prompt which reports the number of currently
         selected tests.
         """
-        return [
-            (Token.PromptNum, '{}'.format(
-                len(self.shell.user_ns['_selection']))),
-            (Token.Prompt, ' selected >>> '),
+        progress, count, selected = prompt_parts(self.shell.user_ns)
+        tokens = [
+            (Token.PromptNum, count),
+            (Token.Prompt, selected),
         ]
+        if progress:
+            tokens.insert(0, (Token.Prompt, progress))
+        return tokens
+
+
+class LazyHistoryManager(HistoryManager):
+    """History manager which connects to its database and starts a new
+    session in a background thread instead of before the prompt appears.
+    Any use of the database blocks until it has been opened.
+    """
+    def __init__(self, **kwargs):
+        self._lock = threading.RLock()
+        self._opened = False
+        self._db = None
+        super(LazyHistoryManager, self).__init__(**kwargs)
+        opener = threading.Thread(
+            target=self._open, name='pytest-interactive-history')
+        opener.daemon = True
+        opener.start()
+
+    def _open(self):
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+            # the connection may be opened from (and used by) any thread
+            self.connection_options = dict(
+                self.connection_options, check_same_thread=False)
+            HistoryManager.init_db(self)
+            try:
+                HistoryManager.new_session(self)
+            except sqlite3.OperationalError:
+                self.log.error(
+                    "Failed to create history session in %s. History will "
+                    "not be saved.", self.hist_file, exc_info=True)
+
+    @property
+    def db(self):
+        self._open()
+        return self._db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+
+    def init_db(self):
+        # deferred until the database is first used
+        if self._opened:
+            super(LazyHistoryManager, self).init_db()
+
+    def new_session(self, conn=None):
+        if conn is not None or self._opened:
+            super(LazyHistoryManager, self).new_session(conn=conn)
+
+    def writeout_cache(self, conn=None):
+        # entries are written under the session number
+        self._open()
+        super(LazyHistoryManager, self).writeout_cache(conn=conn)
 
 
 class PytestShellEmbed(InteractiveShellEmbed):
@@ -27,6 +138,8 @@ class PytestShellEmbed(InteractiveShellEmbed):
     prompts_class = TestCounterPrompt
     # cause if you don't use it shame on you
     editing_mode = 'vi'
+    # ``PhaseTimer`` of the session when ``--ia-profile`` is set
+    pytest_timer = None
 
     def init_history(self):
         """Sets up the command history, and starts regular autosaves.
@@ -36,8 +149,9 @@ class PytestShellEmbed(InteractiveShellEmbed):
             from regular shell sessions such that only relevant commands
             are retained.
         """
-        self.history_manager = HistoryManager(
-            shell=self, parent=self, hist_file=self.pytest_hist_file)
+        with phase(self.pytest_timer, 'history'):
+            self.history_manager = LazyHistoryManager(
+                shell=self, parent=self, hist_file=self.pytest_hist_file)
         self.configurables.append(self.history_manager)
 
     def exit(self):
@@ -45,157 +159,36 @@ class PytestShellEmbed(InteractiveShellEmbed):
         This method calls the ``ask_exit`` callback and if applicable prompts
         the user to verify the current test selection
         """
-        if getattr(self, 'selection', None):
-            print(" \n".join(self.selection.keys()))
-            msg = "\nYou have selected the above {} test(s) to be run."\
-                  "\nWould you like to run pytest now? ([y]/n)?"\
-                  .format(len(self.selection))
-        else:
-            msg = 'Do you really want to exit ([y]/n)?'
-        if self.ask_yes_no(msg, 'y'):
+        if self.ask_yes_no(exit_message(self), 'y'):
             # sets self.keep_running to False
             self.ask_exit()
 
 
+def _magic(name):
+    """Expose the command ``name`` of ``SelectionCommands`` as a line magic
+    """
+    command = getattr(SelectionCommands, name)
+
+    def magic(self, line):
+        return command(self.commands, line)
+    magic.__name__ = name
+    magic.__doc__ = command.__doc__
+    return line_magic(magic)
+
+
 @magics_class
 class SelectionMagics(Magics):
     """Custom magics for performing multiple test selections
     within a single session
     """
-    # XXX do we actually need this or can we do `user_ns` lookups?
-    def ns_eval(self, line):
-        '''Evalutate line in the embedded ns and return result
-        '''
-        ns = self.shell.user_ns
-        return eval(line, ns)
-
-    @property
-    def tt(self):
-        return self.ns_eval('_tree')
-
-    @property
-    def selection(self):
-        return self.tt._selection
-
-    @property
-    def tr(self):
-        return self.tt._tr
-
-    def err(self, msg="No tests selected"):
-        self.tt.err(msg)
-
-    @line_magic
-    def add(self, line):
-        '''Add tests from a test set to the current selection.
-
-        Usage:
-
-        add tt : add all tests in the current tree
-        add tt[4] : add 5th test in the current tree
-        add tt.tests[1:10] : add tests 1-9 found under the 'tests' module
-        '''
-        if line:
-            ts = self.ns_eval(line)
-            if ts:
-                self.selection.addtests(ts)
-            else:
-                raise TypeError("'{}' is not a test set".format(ts))
-        else:
-            print("No test set provided?")
-
-    @line_magic
-    def remove(self, line, delim=','):
-        """Remove tests from the current selection using a slice syntax
-        using a ',' delimiter instead of ':'.
-
-        Usage:
-
-        remove : remove all tests from the current selection
-        remove -1 : remove the last item from the selection
-        remove 1, : remove all but the first item (same as [1:])
-        remove ,,-3 : remove every third item (same as [::-3])
-        """
-        selection = self.selection
-        if not self.selection:
-            self.err()
-            return
-        if not line:
-            selection.clear()
-            return
-        # parse out slice
-        if delim in line:
-            slc = slice(*map(lambda x: int(x.strip()) if x.strip() else None,
-                        line.split(delim)))
-            for item in selection[slc]:
-                selection.remove(item)
-        else:  # just an index
-            try:
-                selection.remove(selection[int(line)])
-            except ValueError:
-                self.err("'{}' is not and index or slice?".format(line))
-
-    @line_magic
-    def show(self, test_set):
-        '''Show all currently selected test by pretty printing
-        to the console.
-
-        Usage:
-
-            show:  print currently selected tests
-        '''
-        items = self.selection.values()
-        if items:
-            self.tt._tprint(items)
-        else:
-            self.err()
-
-    @line_magic
-    def cache(self, line, ident='pytest/interactive'):
-        """Store a set of tests in the pytest cache for retrieval in another
-        session.
-
-        Usage:
-
-            cache: show a summary of names previously stored in the cache.
-
-            cache del <name>: deletes the named entry from the cache.
-
-            cache add <name> <target>: stores the named tests as target name.
-        """
-        cachedict = self.tt.get_cache_dict()
-        if line:
-            tokens = line.split()
-            subcmd, name = tokens[0], tokens[1]
-
-            if subcmd == 'del':  # delete an entry
-                name = tokens[1]
-                self.tt.set_cache_items(name, None)  # delete
-                self.shell.user_ns.pop(name)
-                self.tr.write(
-                    "Deleted cache entry for '{}'\n".format(name))
-                return
-
-            elif subcmd == 'add':  # create a new entry
-                target = tokens[2]
-                if not re.match("[_A-Za-z][_a-zA-Z0-9]*$", target) \
-                        and not keyword.iskeyword(name):
-                    self.tt.err("'{}' is not a valid identifier"
-                                .format(target))
-                    return
-
-                testset = self.ns_eval(name)
-                self.tt.set_cache_items(target, testset)
-
-                # update the local shell's ns
-                if testset:
-                    self.shell.user_ns[target] = testset
-                self.tr.write(
-                    "Created cache entry for '{}'\n".format(name))
-                return
-
-            self.tt.err("'{}' is invalid. See %cache? for usage.".format(line))
-        else:
-            tr = self.tr
-            tr.write("\nSummary:\n", green=True)
-            for name, testnames in cachedict.items():
-                tr.write('{} -> {} items\n'.format(name, len(testnames)))
+    def __init__(self, shell=None, **kwargs):
+        super(SelectionMagics, self).__init__(shell=shell, **kwargs)
+        self.commands = SelectionCommands(shell)
+
+    add = _magic('add')
+    remove = _magic('remove')
+    run = _magic('run')
+    find = _magic('find')
+    budget = _magic('budget')
+    show = _magic('show')
+    cache = _magic('cache')
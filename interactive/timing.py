@@ -0,0 +1,296 @@
+"""
+Opt-in timing (and profiling) of the phases of the shell's startup and
+accounting of the time spent in the shell during a session
+"""
+import os
+import time
+import contextlib
+from collections import OrderedDict
+import pytest
+
+PROFILE_KEY = 'pytest-interactive/profile'
+SESSION_KEY = 'pytest-interactive/session'
+
+
+@contextlib.contextmanager
+def _noop():
+    yield
+
+
+def phase(timer, name):
+    """Time the enclosed block as ``name`` if ``timer`` is set
+    """
+    return timer.phase(name) if timer else _noop()
+
+
+def get_timer(config):
+    return getattr(config, '_ia_timer', None)
+
+
+def shell_time(config, concurrent=False):
+    """Time the enclosed shell session if the session timer is registered
+    """
+    timer = getattr(config, '_ia_session_timer', None)
+    return timer.shell(concurrent) if timer else _noop()
+
+
+class PhaseTimer(object):
+    """Plugin recording the wall time of each named startup phase from
+    ``pytest_configure`` until the shell's prompt. Phases may be nested in
+    which case only the time spent outside of any inner phase is counted
+    towards the outer one. If ``cprofile`` is set the whole startup is
+    also profiled with ``cProfile``.
+    """
+    # number of runs kept in the cache
+    history = 20
+
+    def __init__(self, config, cprofile=False):
+        self.config = config
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self._stack = []  # time spent in inner phases of each open phase
+        self._marks = {}
+        self.finished = False
+        self.profiler = None
+        if cprofile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        self._stack.append(0.)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            inner = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.add(name, elapsed - inner)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.) + seconds
+
+    def mark(self, name):
+        self._marks[name] = time.time()
+
+    def stop(self, name):
+        """Record the time since ``mark(name)`` as phase ``name``
+        """
+        start = self._marks.pop(name, None)
+        if start is not None:
+            self.add(name, time.time() - start)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_collection(self, session):
+        # stopped once the interactive plugin receives the items
+        self.mark('collection')
+        yield
+
+    def results(self, **info):
+        total = time.time() - self.start
+        phases = OrderedDict(self.phases)
+        phases['other'] = max(total - sum(phases.values()), 0.)
+        info.update(time=self.start, total=total, phases=phases)
+        return info
+
+    def finish(self, tr, **info):
+        """Report the breakdown of the startup (once) and append the results
+        to the runs stored in the cache
+        """
+        if self.finished:
+            return
+        self.finished = True
+        results = self.results(**info)
+        total = results['total']
+        tr.write_line("")
+        tr.write_line("pytest-interactive startup:", bold=True)
+        for name, seconds in results['phases'].items():
+            tr.write_line("  {:<12}{:>9.3f}s {:>5.1f}%".format(
+                name, seconds, 100. * seconds / total if total else 0.))
+        tr.write_line("  {:<12}{:>9.3f}s".format('total', total))
+        cache = getattr(self.config, 'cache', None)
+        if cache is None:
+            return
+        runs = cache.get(PROFILE_KEY, [])
+        runs.append(results)
+        cache.set(PROFILE_KEY, runs[-self.history:])
+        if self.profiler:
+            self.profiler.disable()
+            mkdir = getattr(cache, 'mkdir', None) or cache.makedir
+            path = os.path.join(
+                str(mkdir('pytest-interactive')), 'startup.prof')
+            self.profiler.dump_stats(path)
+            tr.write_line("cProfile stats written to {} (view with "
+                          "'python -m pstats')".format(path))
+
+
+class _Duration(object):
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class _ShiftedInstant(object):
+    """Proxy of a ``_pytest.timing.Instant`` who's elapsed time excludes
+    ``offset`` seconds
+    """
+    def __init__(self, instant, offset):
+        self._instant = instant
+        self._offset = offset
+
+    def elapsed(self):
+        seconds = self._instant.elapsed().seconds - self._offset
+        return _Duration(max(seconds, 0.))
+
+    def __getattr__(self, name):
+        return getattr(self._instant, name)
+
+
+def _shift(obj, attrs, seconds):
+    '''Move the start time stored as the first present attribute of
+    ``attrs`` on ``obj`` forward by ``seconds``
+    '''
+    for attr in attrs:
+        start = getattr(obj, attr, None)
+        if start is None:
+            continue
+        if isinstance(start, (int, float)):  # pytest < 8.4
+            setattr(obj, attr, start + seconds)
+        else:
+            setattr(obj, attr, _ShiftedInstant(start, seconds))
+        return
+
+
+def _overlap(start, stop, other_start, other_stop):
+    return max(min(stop, other_stop) - max(start, other_start), 0.)
+
+
+class SessionTimer(object):
+    """Plugin measuring the time spent collecting, in the shell and running
+    tests. Time the session was held up by the shell is excluded from the
+    duration reported by ``pytest`` (and ``--junitxml``) and the breakdown
+    is shown in the terminal summary and stored in the cache.
+
+    When collection continues in the background (``--ia-stream``) only the
+    time spent in the shell after collection completed is excluded. Tests
+    run from the shell with ``%run`` count as shell time.
+    """
+    # number of sessions kept in the cache
+    history = 20
+
+    def __init__(self, config):
+        self.config = config
+        self.start = time.time()
+        self._collection = [None, None]
+        self._shell = None  # (start, stop, concurrent)
+        self.run = 0.
+        self.collected = None
+        self.results = None
+
+    @contextlib.contextmanager
+    def shell(self, concurrent=False):
+        """Time the enclosed shell session; ``concurrent`` is set when
+        collection is still running while the shell is open
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._shell = (start, time.time(), concurrent)
+
+    def pytest_sessionstart(self, session):
+        self.start = time.time()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_collection(self, session):
+        self._collection[0] = time.time()
+        yield
+
+    def pytest_collection_modifyitems(self, items):
+        # before the selection is applied (a streamed collection completes
+        # here but only finishes once the shell has exited)
+        self.collected = len(items)
+        self._collection[1] = time.time()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtestloop(self, session):
+        start = time.time()
+        yield
+        self.run += time.time() - start
+
+    def times(self):
+        """Return the session's ``session``, ``collection``, ``shell``,
+        ``excluded`` (shell time removed from the session) and ``run``
+        times in seconds
+        """
+        now = time.time()
+        shell = excluded = 0.
+        start, stop = self._collection
+        collection = None
+        if start is not None:
+            collection = (stop or now) - start
+        if self._shell:
+            shell_start, shell_stop, concurrent = self._shell
+            shell = excluded = shell_stop - shell_start
+            if concurrent and stop is not None:
+                excluded = max(shell_stop - max(shell_start, stop), 0.)
+            elif collection is not None:
+                collection -= _overlap(
+                    shell_start, shell_stop, start, stop or now)
+        return OrderedDict([
+            ('session', now - self.start - excluded),
+            ('collection', collection),
+            ('shell', shell),
+            ('excluded', excluded),
+            ('run', self.run),
+        ])
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self._shell is None:
+            return
+        times = self.times()
+        excluded = times['excluded']
+        if excluded:
+            tr = self.config.pluginmanager.getplugin('terminalreporter')
+            if tr is not None:
+                _shift(tr, ('_session_start', '_sessionstarttime'), excluded)
+            xml = _junitxml(self.config)
+            if xml is not None:
+                _shift(xml, ('suite_start', 'suite_start_time'), excluded)
+        self.results = results = dict(
+            times, time=self.start, exitstatus=int(exitstatus),
+            collected=self.collected, selected=len(session.items))
+        cache = getattr(self.config, 'cache', None)
+        if cache is not None:
+            runs = cache.get(SESSION_KEY, [])
+            runs.append(results)
+            cache.set(SESSION_KEY, runs[-self.history:])
+
+    def pytest_terminal_summary(self, terminalreporter):
+        results = self.results
+        if results is None:
+            return
+        from .durations import format_duration
+        parts = ['{} {}'.format(name, format_duration(results[name]))
+                 for name in ('collection', 'shell', 'run')
+                 if results[name] is not None]
+        terminalreporter.write_line(
+            "pytest-interactive: {} ({} of shell time excluded from the "
+            "session duration)".format(
+                ', '.join(parts), format_duration(results['excluded'])))
+
+
+def _junitxml(config):
+    try:
+        from _pytest.junitxml import LogXML
+    except ImportError:
+        return None
+    for plugin in config.pluginmanager.get_plugins():
+        if isinstance(plugin, LogXML):
+            return plugin
+    return None
@@ -0,0 +1,58 @@
+"""
+Plugin loaded by the worker processes of a parallel ``%run`` which streams
+test reports back to the shell's process
+"""
+import os
+import json
+
+FD_ENV = 'PYTEST_INTERACTIVE_WORKER_FD'
+NODEIDS_ENV = 'PYTEST_INTERACTIVE_WORKER_NODEIDS'
+
+
+def pytest_configure(config):
+    fd = os.environ.get(FD_ENV)
+    if fd is not None:
+        config.pluginmanager.register(
+            WorkerReporter(config, os.fdopen(int(fd), 'w'),
+                           os.environ[NODEIDS_ENV]),
+            'interactive-worker')
+
+
+class WorkerReporter(object):
+    """Run only the assigned node ids and write each runtest event as a
+    json line to ``stream``
+    """
+    def __init__(self, config, stream, nodeids_path):
+        self.config = config
+        self.stream = stream
+        self.nodeids_path = nodeids_path
+
+    def send(self, event, **kwargs):
+        kwargs['event'] = event
+        self.stream.write(json.dumps(kwargs) + '\n')
+        self.stream.flush()
+
+    def pytest_collection_modifyitems(self, config, items):
+        with open(self.nodeids_path) as f:
+            nodeids = f.read().splitlines()
+        byid = dict((item.nodeid, item) for item in items)
+        selected = [byid[nodeid] for nodeid in nodeids if nodeid in byid]
+        chosen = set(selected)
+        deselected = [item for item in items if item not in chosen]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+    def pytest_runtest_logstart(self, nodeid, location):
+        self.send('logstart', nodeid=nodeid, location=location)
+
+    def pytest_runtest_logreport(self, report):
+        hook = self.config.hook
+        self.send('report', data=hook.pytest_report_to_serializable(
+            config=self.config, report=report))
+
+    def pytest_runtest_logfinish(self, nodeid, location):
+        self.send('logfinish', nodeid=nodeid, location=location)
+
+    def pytest_unconfigure(self, config):
+        self.stream.close()
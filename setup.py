@@ -22,6 +22,7 @@ setup(
      ]},
      zip_safe=False,
      install_requires=['pytest>=2.4.2', 'ipython>=5.0'],
+     python_requires='>=3',
      classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -30,7 +31,6 @@ setup(
         'Operating System :: Microsoft :: Windows',
         'Operating System :: MacOS :: MacOS X',
         'Topic :: Software Development :: Testing',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
         'Environment :: Console',
      ],
@@ -0,0 +1,17 @@
+import sys
+import pytest
+
+pytest_plugins = 'pytester'
+
+
+@pytest.fixture
+def shell(pytester):
+    """Run ``pytest --ia`` with the lite shell in a subprocess feeding it
+    the provided lines of shell input
+    """
+    def run(lines, *args):
+        stdin = ''.join(line + '\n' for line in lines).encode()
+        return pytester.run(
+            sys.executable, '-m', 'pytest', '--ia', '--ia-shell=lite',
+            *args, stdin=stdin, timeout=120)
+    return run
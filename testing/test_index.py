@@ -0,0 +1,92 @@
+"""
+Saving, loading and invalidating the ``--ia-cached`` tree index
+"""
+import os
+import pytest
+
+MISS = "No valid cached test index"
+
+
+@pytest.fixture
+def suite(pytester):
+    pytester.makeini("[pytest]")
+    tests = pytester.mkpydir('tests')
+    tests.joinpath('test_a.py').write_text(
+        "import pytest\n"
+        "@pytest.mark.parametrize('x', ['dog', 'cat'])\n"
+        "def test_a(x): pass\n"
+        "def test_b(): pass\n")
+    sub = tests / 'sub'
+    sub.mkdir()
+    sub.joinpath('test_c.py').write_text("def test_c(): pass\n")
+    return tests
+
+
+def touch(path, delta=10):
+    """Move the mtime of ``path`` forward such that the change is seen
+    regardless of the file system's timestamp resolution
+    """
+    st = os.stat(str(path))
+    os.utime(str(path), (st.st_atime, st.st_mtime + delta))
+
+
+def select(pytester, expr='tt', *args):
+    return pytester.runpytest_subprocess(
+        '--ia-cached', '--ia-select', expr, *args)
+
+
+def test_hit_after_save(pytester, suite):
+    result = select(pytester, 'tt', 'tests')
+    result.stdout.fnmatch_lines(['*' + MISS + '*'])
+    result.assert_outcomes(passed=4)
+    # the first save creates the cache inside the rootdir
+    result = select(pytester, 'tt', 'tests')
+    result.stdout.no_fnmatch_line('*' + MISS + '*')
+    result.assert_outcomes(passed=4)
+
+
+def test_options_share_index(pytester, suite):
+    select(pytester, 'tt', 'tests')
+    # other flags and select expressions use the same index
+    result = select(pytester, "tt.find('test_c')", '-x', '-q', 'tests')
+    result.stdout.no_fnmatch_line('*' + MISS + '*')
+    result.assert_outcomes(passed=1)
+    result = select(pytester, "tt.find('test_a').params.cat", 'tests')
+    result.stdout.no_fnmatch_line('*' + MISS + '*')
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize('change', ['modify', 'add'])
+def test_invalidated_by_test_changes(pytester, suite, change):
+    select(pytester, 'tt', 'tests')
+    if change == 'modify':
+        path = suite / 'test_a.py'
+        path.write_text(path.read_text() + "def test_d(): pass\n")
+        touch(path)
+    else:
+        path = suite / 'sub' / 'test_e.py'
+        path.write_text("def test_e(): pass\n")
+        touch(path.parent)
+    result = select(pytester, 'tt', 'tests')
+    result.stdout.fnmatch_lines(['*' + MISS + '*'])
+    result.assert_outcomes(passed=5)
+
+
+def test_rootdir_changes_keep_index(pytester, suite):
+    select(pytester, 'tt', 'tests')
+    pytester.path.joinpath('notes.txt').write_text('')
+    touch(pytester.path)
+    result = select(pytester, 'tt', 'tests')
+    result.stdout.no_fnmatch_line('*' + MISS + '*')
+
+
+def test_old_indices_pruned(pytester, suite):
+    from interactive.index import INDEX_HISTORY
+    paths = ['tests', 'tests/sub', 'tests/test_a.py', 'tests/sub/test_c.py',
+             'tests/test_a.py::test_b', '.']
+    for path in paths:
+        select(pytester, 'tt', path)
+    indexdir = pytester.path / '.pytest_cache' / 'd' / 'pytest-interactive'
+    names = [name for name in os.listdir(str(indexdir))
+             if name.startswith('index-')]
+    assert len(names) == INDEX_HISTORY
@@ -0,0 +1,32 @@
+"""
+Running tests from the shell and relaying the results of worker processes
+"""
+
+
+def test_run_in_workers(shell, pytester):
+    pytester.makeini("[pytest]")
+    pytester.makepyfile(test_a="""
+        import pytest
+
+        @pytest.mark.parametrize('x', range(3))
+        def test_pass(x): pass
+
+        def test_fail():
+            assert 'relayed' == 'failure'
+        """)
+    result = shell(["add tt", "run -n 2", "exit"])
+    result.stdout.fnmatch_lines([
+        "*test_fail*",
+        "*assert 'relayed' == 'failure'*",
+        "*1 failed, 3 passed in*",
+    ])
+
+
+def test_run_in_process(shell, pytester):
+    pytester.makeini("[pytest]")
+    pytester.makepyfile(test_a="""
+        def test_pass(): pass
+        def test_fail(): assert 0
+        """)
+    result = shell(["add tt", "run", "exit"])
+    result.stdout.fnmatch_lines(["*1 failed, 1 passed in*"])
@@ -0,0 +1,52 @@
+"""
+Streaming collection into the shell with ``--ia-stream``
+"""
+import pytest
+
+# block until the collection thread has fed the whole tree to the shell
+WAIT = ["import time",
+        "while _tree._collecting: time.sleep(0.05)",
+        ""]
+
+
+@pytest.fixture
+def suite(pytester):
+    pytester.makeini("[pytest]")
+    for name in 'abc':
+        pytester.makepyfile(**{'test_' + name: """
+            import time
+            time.sleep(0.3)
+
+            def test_pass(): pass
+            def test_fail(): assert 0
+            """})
+
+
+def test_selection_deselects(shell, suite):
+    result = shell(WAIT + ["add tt.find('test_b')", "exit"], '--ia-stream')
+    result.stdout.fnmatch_lines([
+        "*collected 6 items / 4 deselected / 2 selected*",
+        "*[[]100%[]]*",
+    ])
+    result.assert_outcomes(passed=1, failed=1, deselected=4)
+
+
+def test_empty_selection(shell, suite):
+    result = shell(WAIT + ["exit"], '--ia-stream')
+    result.assert_outcomes(deselected=6)
+
+
+def test_run_refused_while_collecting(shell, pytester):
+    pytester.makeini("[pytest]")
+    pytester.makepyfile(test_slow="""
+        import time
+        time.sleep(3)
+
+        def test_pass(): pass
+        """)
+    result = shell(["run"] + WAIT + ["add tt", "run", "exit"],
+                   '--ia-stream')
+    result.stdout.fnmatch_lines([
+        "*Tests can not be run until collection has completed*",
+        "*1 passed*",
+    ])